@@ -87,13 +87,25 @@ def filter():
         action="store_true",
         help="overwrite existing zip files",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of chunks filtered in parallel processes (default 1)",
+    )
+    parser.add_argument(
+        "-r",
+        "--rules",
+        help="toml file with filter rules (default: rules in mpapi/data/filter.toml)",
+    )
     parser.add_argument(
         "-s",
         "--src",
         help="input file",
     )
     args = _setup_args(parser)
-    filter_(src=args.src, force=args.force)
+    filter_(src=args.src, force=args.force, jobs=args.jobs, rules=args.rules)
 
 
 def getAttachment():
@@ -19,6 +19,9 @@ USAGE
     for chunkM in c.search(query=query, offset=0):
         do_something_with (chunkM)
 
+    # fetch up to 4 chunks at the same time; chunks are still yielded in order
+    c = Chunky(chunkSize=1000, baseURL=baseURL, pw=pw, user=user, workers=4)
+
 
 TOWARDS AN ALGORITHM
 A "deterministic" solution would first (1) query how many results there are
@@ -32,6 +35,11 @@ know the total number of results until we have gotten all results?
 Let's look for the simplest solution: A chunk is the last chunk if the number
 of results is smaller than chunkSize.
 
+NEW: We now plan deterministically. A count query (limit=0) gets the totalSize
+first; then all chunks are fetched by a pool of workers and yielded in order
+(see _paginate). If the last planned chunk is full (since items were added
+in the meantime), we continue chunk by chunk until a chunk is short.
+
 NOTES / QUESTIONS / DEFINITIONS
 * The chunky (=paginated) search is expected not to be faster than an
   unchunked search since it will likely involve more http requests for the
@@ -45,15 +53,26 @@ NOTES / QUESTIONS / DEFINITIONS
   But we decided against it; this can be done later, if really of use.
 * Should we write chunks to disk? No. That's not chunky's job. Should be
   done by mink etc.
+* Related Multimedia and Person items often appear in many chunks. During a
+  run (one call of getByType or search), they are downloaded only once and
+  taken from a RelatedCache afterwards.
 """
 
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice
+import logging
 from lxml import etree
-from mpapi.client import MpApi
+from mpapi.client import MpApi, TransportPolicy
+from mpapi.constants import XPATH
 from mpapi.helper import Helper
 from mpapi.module import Module
 from mpapi.sar import Sar
 from mpapi.search import Search
-from typing import Any, Iterator
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+import threading
+from typing import Any, Callable, Iterable, Iterator
 
 NSMAP = {
     "s": "http://www.zetcom.com/ria/ws/module/search",
@@ -75,11 +94,131 @@ user: str
 allowed_types = ["approval", "exhibit", "group", "loc", "query"]
 
 
+class RelatedCache:
+    """
+    Cache for related items during one run, so that items that appear in
+    many chunks are downloaded only once.
+
+    USAGE
+        cache = RelatedCache(maxItems=10000, spillDir="cache")
+        cache.put(itemN=itemN, mtype="Person")
+        itemN = cache.get(mtype="Person", ID=1234)  # None if not cached
+        cache.miss(mtype="Person", ID=1235)  # requested, but not found
+        cache.missing(mtype="Person", ID=1235)  # True
+
+    Items are kept as serialized xml in an LRU with at most maxItems entries.
+    If spillDir is given, items that fall out of the LRU are written there
+    instead of being forgotten. Every entry remembers the item's
+    lastModified, so a newer version of an item replaces an older one, but
+    not vice versa.
+
+    Items are cached per run, since what we find depends on the query's
+    since and onlyPublished. The cache is thread safe.
+    """
+
+    def __init__(self, *, maxItems: int = 10000, spillDir: Path | str | None = None):
+        self.maxItems = maxItems
+        self.spillDir = Path(spillDir) if spillDir is not None else None
+        if self.spillDir is not None:
+            self.spillDir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lru: OrderedDict = OrderedDict()  # (mtype, ID): (lastMod, xml)
+        self._spilled: dict = {}  # (mtype, ID): lastMod
+        self._missing: set = set()  # (mtype, ID)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lru) + len(self._spilled)
+
+    def get(self, *, mtype: str, ID: int) -> ET | None:
+        """
+        Returns a new copy of the cached item or None.
+        """
+        key = (mtype, int(ID))
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                xml = self._lru[key][1]
+            elif key in self._spilled:
+                xml = self._spillPath(key).read_bytes()
+            else:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return etree.fromstring(xml, ETparser)
+
+    def miss(self, *, mtype: str, ID: int) -> None:
+        """
+        Remember that an item was requested, but not found.
+        """
+        with self._lock:
+            self._missing.add((mtype, int(ID)))
+
+    def missing(self, *, mtype: str, ID: int) -> bool:
+        return (mtype, int(ID)) in self._missing
+
+    def put(self, *, itemN: ET, mtype: str) -> None:
+        key = (mtype, int(itemN.get("id")))
+        lastMod = XPATH["lastModified"](itemN)
+        with self._lock:
+            old = self._lru[key][0] if key in self._lru else self._spilled.get(key)
+            if old is not None and old > lastMod:
+                return
+            self._lru[key] = (lastMod, etree.tostring(itemN))
+            self._lru.move_to_end(key)
+            self._spilled.pop(key, None)
+            self._missing.discard(key)
+            while len(self._lru) > self.maxItems:
+                oldKey, (oldMod, xml) = self._lru.popitem(last=False)
+                if self.spillDir is not None:
+                    self._spillPath(oldKey).write_bytes(xml)
+                    self._spilled[oldKey] = oldMod
+
+    def _spillPath(self, key: tuple) -> Path:
+        return self.spillDir / f"{key[0]}-{key[1]}.xml"
+
+
 class Chunky(Helper):
-    def __init__(self, *, chunkSize: int, baseURL: str, pw: str, user: str) -> None:
+    def __init__(
+        self,
+        *,
+        chunkSize: int,
+        baseURL: str,
+        pw: str,
+        user: str,
+        policy: TransportPolicy | None = None,
+        workers: int = 1,
+        batchSize: int = 250,
+        cacheSize: int = 10000,
+        cacheDir: Path | str | None = None,
+    ) -> None:
+        """
+        workers: number of chunks (and batches of related items per chunk)
+            that are fetched at the same time; also the max number of
+            requests to RIA at the same time (for all chunks together)
+        batchSize: max number of IDs in one query for related items
+        cacheSize: max number of related items kept in memory per run (see
+            RelatedCache); 0 switches the cache off
+        cacheDir: if given, related items that don't fit in memory are
+            written there
+        """
         self.chunkSize = chunkSize
-        self.api = MpApi(baseURL=baseURL, user=user, pw=pw)
-        self.sar = Sar(baseURL=baseURL, user=user, pw=pw)
+        self.workers = workers
+        self.batchSize = batchSize
+        self.cacheSize = cacheSize
+        self.cacheDir = cacheDir
+        self.api = MpApi(baseURL=baseURL, user=user, pw=pw, policy=policy)
+        self.sar = Sar(baseURL=baseURL, user=user, pw=pw, policy=self.api.policy)
+        # Chunks, Multimedia/Person and batches are fetched by nested thread
+        # pools; all of them share these slots, so at most workers requests
+        # run at the same time and the connection pool is big enough for them
+        self._slots = threading.BoundedSemaphore(max(workers, 1))
+        adapter = HTTPAdapter(
+            pool_connections=max(workers, 1), pool_maxsize=max(workers, 1)
+        )
+        self.api.session.mount("https://", adapter)
+        self.api.session.mount("http://", adapter)
 
     def getByType(
         self,
@@ -117,31 +256,33 @@ class Chunky(Helper):
         if Type not in allowed_types:
             raise SyntaxError(f"Error: Chunk type not recognized: {Type}")
 
-        lastChunk: bool = False
-        while not lastChunk:
-            chunkData = Module()  # new zml Module object
+        def fetch(offset: int) -> Module:
             if Type == "query":
                 m = self._savedQuery(Type=target, ID=ID, offset=offset)
             else:
                 m = self._getObjects(Type=Type, ID=ID, offset=offset, since=since)
-            chunkData += m
-            # only look for related data if there is something in current chunk
-            if m:
-                # all related Multimedia and Persons items, no chunking
-                for targetType in ["Multimedia", "Person"]:
-                    relatedM = self._relatedItems(
-                        part=m.toET(),
-                        target=targetType,
-                        since=since,
-                        onlyPublished=onlyPublished,
-                    )
-                    if relatedM:
-                        chunkData += relatedM
-
-            offset += self.chunkSize  # wrong for last chunk
-            if chunkData.actualSize(module="Object") < self.chunkSize:
-                lastChunk = True
-            yield chunkData
+            return self._chunk(
+                part=m, since=since, onlyPublished=onlyPublished, cache=cache
+            )
+
+        cache = self._newCache()
+
+        if Type == "query":
+            try:
+                total = self._savedQuery(Type=target, ID=ID, limit=0).totalSize(
+                    module=target
+                )
+            except TypeError:  # no hits
+                total = 0
+        else:
+            target = "Object"
+            total = self._count(
+                query=self._objectQuery(Type=Type, ID=ID, limit=0, since=since)
+            )
+        yield from self._paginate(
+            fetch=fetch, offset=offset, total=total, target=target
+        )
+        self._logCache(cache)
 
     def search(
         self, query: Search, since: since = None, offset: int = 0
@@ -151,33 +292,142 @@ class Chunky(Helper):
         (presumably one which finds object items). We split the results into
         chunks and add the related items to every chunk.
 
+        The query is not changed; every chunk uses a copy with its own offset
+        and limit (chunkSize).
+
         TODO: test this
         """
-        lastChunk: bool = False
-        while not lastChunk:
-            chunkData = Module()  # make a new zml module document
-            query.offset(value=offset)  # todo in search
-            m = self.api.search2(query=query)
-            chunkData += m
-            # all related Multimedia and Persons items, no chunking
-            for targetType in ["Multimedia", "Person"]:
-                relatedM = self._relatedItems(
-                    part=partET, target=targetType, since=since
-                )
-                if relatedM:
-                    chunkData += relatedM
 
-            offset = offset + self.chunkSize
-            # print(f"*** actual VS chunkSize: {actualNo} VS {self.chunkSize}")
+        def page(*, offset: int, limit: int) -> Search:
+            q = Search(fromString=query.toString())
+            q.offset(value=offset)
+            q.limit(value=limit)
+            return q
 
-            if chunkData.actualSize(module="Object") < self.chunkSize:
-                lastChunk = True
-            yield chunkData
+        def fetch(offset: int) -> Module:
+            m = self._request(
+                self.api.search2, query=page(offset=offset, limit=self.chunkSize)
+            )
+            return self._chunk(part=m, since=since, cache=cache)
+
+        cache = self._newCache()
+        total = self._count(query=page(offset=0, limit=0))
+        target = XPATH["searchModuleName"](query.etree)[0]
+        yield from self._paginate(
+            fetch=fetch, offset=offset, total=total, target=target
+        )
+        self._logCache(cache)
 
     #
     # private methods
     #
 
+    def _chunk(
+        self,
+        *,
+        part: Module,
+        since: since = None,
+        onlyPublished: bool = False,
+        cache: RelatedCache | None = None,
+    ) -> Module:
+        """
+        Make a chunk from a part with object items: add all related Multimedia
+        and Person items (no chunking).
+
+        Multimedia and Person items are requested at the same time. The part
+        itself becomes the chunk, i.e. it's changed.
+        """
+        chunkData = part
+        # only look for related data if there is something in current chunk
+        if not part:
+            return chunkData
+
+        def fetch(targetType: str) -> Module:
+            return self._relatedItems(
+                part=part.toET(),
+                target=targetType,
+                since=since,
+                onlyPublished=onlyPublished,
+                cache=cache,
+            )
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            relatedL = list(executor.map(fetch, ["Multimedia", "Person"]))
+        for relatedM in relatedL:
+            if relatedM:
+                chunkData.add(doc=relatedM.etree)
+        return chunkData
+
+    def _count(self, *, query: Search) -> int:
+        """
+        Number of hits for query according to RIA's totalSize. Query should
+        have limit=0, so no items are transferred.
+        """
+        mtype = XPATH["searchModuleName"](query.etree)[0]
+        m = self._request(self.api.search2, query=query)
+        try:
+            return m.totalSize(module=mtype)
+        except TypeError:  # no module element if no hits
+            return 0
+
+    def _paginate(
+        self,
+        *,
+        fetch: Callable[[int], Module],
+        offset: int,
+        total: int,
+        target: str = "Object",
+    ) -> Iterator[Module]:
+        """
+        Yields fetch(offset) for every chunk from offset to total in order.
+
+        With more than one worker, chunks are fetched in a thread pool. At
+        most 2 * workers chunks are in flight or waiting to be consumed, so
+        memory stays bounded if the consumer is slower than RIA.
+
+        If the last chunk is full, the result set has grown since we counted;
+        then we go on chunk by chunk until a chunk is short.
+        """
+        offsets = range(offset, total, self.chunkSize)
+        chunkData = None
+        for chunkData in self._inOrder(fetch=fetch, args=offsets):
+            yield chunkData
+        if chunkData is not None and not self._isFull(chunkData, target):
+            return
+        start = offsets[-1] + self.chunkSize if offsets else offset
+        for offset in count(start, self.chunkSize):
+            chunkData = fetch(offset)
+            if not chunkData:
+                break
+            yield chunkData
+            if not self._isFull(chunkData, target):
+                break
+
+    def _inOrder(self, *, fetch: Callable, args: Iterable) -> Iterator:
+        """
+        Like map(fetch, args), but with self.workers threads.
+        """
+        if self.workers < 2:
+            yield from map(fetch, args)
+            return
+        args = iter(args)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            window = deque(
+                executor.submit(fetch, arg) for arg in islice(args, self.workers * 2)
+            )
+            try:
+                while window:
+                    result = window.popleft().result()
+                    for arg in islice(args, 1):
+                        window.append(executor.submit(fetch, arg))
+                    yield result
+            finally:  # e.g. consumer stopped early or an error occurred
+                for future in window:
+                    future.cancel()
+
+    def _isFull(self, chunkData: Module, target: str) -> bool:
+        return chunkData.actualSize(module=target) >= self.chunkSize
+
     def _getObjects(
         self, *, Type: str, ID: int, offset: int, since: since = None
     ) -> Module:
@@ -196,6 +446,29 @@ class Chunky(Helper):
         * ATM this is a getByGroup query always, but a generic getPart query as
           the name of the method suggests.
         """
+        s = self._objectQuery(
+            Type=Type, ID=ID, limit=self.chunkSize, offset=offset, since=since
+        )
+        return self._request(self.api.search2, query=s)
+
+    def _logCache(self, cache: RelatedCache | None) -> None:
+        if cache is not None:
+            logging.info(
+                f"related items cache: {cache.hits} hits, {cache.misses} misses"
+            )
+
+    def _newCache(self) -> RelatedCache | None:
+        if self.cacheSize:
+            return RelatedCache(maxItems=self.cacheSize, spillDir=self.cacheDir)
+        return None
+
+    def _objectQuery(
+        self, *, Type: str, ID: int, limit: int, offset: int = 0, since: since = None
+    ) -> Search:
+        """
+        Returns the query for the object part of a chunk; use limit=0 to only
+        count the hits.
+        """
         fields: dict = {  # TODO: untested
             "approval": "ObjPublicationGrp.TypeVoc",
             "exhibit": "ObjRegistrarRef.RegExhibitionRef.__id",
@@ -203,7 +476,7 @@ class Chunky(Helper):
             "loc": "ObjCurrentLocationVoc",
         }
 
-        s = Search(module="Object", limit=self.chunkSize, offset=offset)
+        s = Search(module="Object", limit=limit, offset=offset)
 
         if since is not None:
             s.AND()
@@ -222,10 +495,16 @@ class Chunky(Helper):
             )
         # print(s.toString())
         s.validate(mode="search")
-        return self.api.search2(query=s)
+        return s
 
     def _relatedItems(
-        self, *, part: ET, target: str, since: since = None, onlyPublished: bool = False
+        self,
+        *,
+        part: ET,
+        target: str,
+        since: since = None,
+        onlyPublished: bool = False,
+        cache: RelatedCache | None = None,
     ) -> Module:
         """
         For a zml document, return all related items of the target type.
@@ -234,67 +513,166 @@ class Chunky(Helper):
         * part as ET: input (object) data with references to related data
         * target:  target module type (either "Person" or "Multimedia")
         * since: TODO. Date to filter for updates
+        * cache: optional RelatedCache; only items that are not in the cache
+          are requested from RIA
 
         NEW
         * returns Module, not ET | None
         * avoid optional (mixed) return value
+        * IDs are split into batches of batchSize, so RIA doesn't have to deal
+          with thousands of OR clauses in one query. Batches are run by
+          self.workers threads and merged into one Module.
         """
 
-        IDs: Any = part.xpath(
-            f"//m:moduleReference[@targetModule = '{target}']/m:moduleReferenceItem/@moduleItemId",
-            namespaces=NSMAP,
-        )
+        IDs: Any = XPATH["relatedIds"](part, target=target)
 
         if len(IDs) == 0:
             print(f"***WARN: No related {target} IDs found!")  # this is not an ERROR
             return Module()
 
+        relIDs = sorted(set(IDs))  # IDs are not necessarily unique
+        cachedL = []
+        if cache is not None:
+            newIDs = []
+            for ID in relIDs:
+                if cache.missing(mtype=target, ID=ID):
+                    continue
+                itemN = cache.get(mtype=target, ID=ID)
+                if itemN is None:
+                    newIDs.append(ID)
+                else:
+                    cachedL.append(itemN)
+            relIDs = newIDs
+
+        batches = [
+            relIDs[i : i + self.batchSize]
+            for i in range(0, len(relIDs), self.batchSize)
+        ]
+
+        def fetch(batch: list) -> Module:
+            s = self._relatedQuery(
+                IDs=batch, target=target, since=since, onlyPublished=onlyPublished
+            )
+            m = self._request(self.api.search2, query=s)
+            if cache is not None:
+                self._fillCache(cache=cache, data=m, mtype=target, IDs=batch)
+            return m
+
+        if len(batches) < 2 or self.workers < 2:
+            result = self._merge(map(fetch, batches))
+        else:
+            # separate pool from _inOrder's, so chunk workers can wait for it
+            workers = min(self.workers, len(batches))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                result = self._merge(executor.map(fetch, batches))
+        if cachedL:
+            cachedM = Module()
+            moduleN = cachedM.module(name=target)
+            for itemN in cachedL:
+                moduleN.append(itemN)
+            result.add(doc=cachedM.etree)
+        return result
+
+    def _fillCache(
+        self, *, cache: RelatedCache, data: Module, mtype: str, IDs: list
+    ) -> None:
+        """
+        Put the items in data in the cache and remember which of the
+        requested IDs were not found.
+        """
+        found = set()
+        for itemN in XPATH["itemsByType"](data.etree, mtype=mtype):
+            cache.put(itemN=itemN, mtype=mtype)
+            found.add(int(itemN.get("id")))
+        for ID in IDs:
+            if int(ID) not in found:
+                cache.miss(mtype=mtype, ID=ID)
+
+    def _merge(self, moduleL: Iterable[Module]) -> Module:
+        result = Module()
+        for m in moduleL:
+            result.add(doc=m.etree)
+        return result
+
+    def _relatedQuery(
+        self,
+        *,
+        IDs: list,
+        target: str,
+        since: since = None,
+        onlyPublished: bool = False,
+    ) -> Search:
+        """
+        Query for the target items with IDs (one batch).
+
+        The ID criteria are ORed; since and onlyPublished restrict the result
+        further, i.e. are ANDed.
+        """
         # use limit=0 for a deterministic search as RIA's response provides the
         # number of search results limit -1 not documented at
         # http://docs.zetcom.com/ws/ seems to return all results
         s = Search(module=target, limit=-1, offset=0)
-        relIDs = set(IDs)  # IDs are not necessarily unique, but we want unique
-        count = 1  # one-based out of tradition; counting unique IDs
-        for ID in sorted(relIDs):
-            # print(f"{target} {ID}")
-            if count == 1 and len(relIDs) > 1:
-                s.OR()
+        restricted = since is not None or (onlyPublished and target == "Multimedia")
+        if restricted:
+            s.AND()
+        if len(IDs) > 1:
+            s.OR()
+        for ID in IDs:
             s.addCriterion(
                 operator="equalsField",
                 field="__id",
                 value=str(ID),
             )
-            count += 1
+        if len(IDs) > 1:
+            s.endConjunction()
         if since is not None:
-            s.AND()
             s.addCriterion(
                 operator="greater",
                 field="__lastModified",
                 value=str(since),  # "2021-12-23T12:00:00.0"
             )
         if onlyPublished and target == "Multimedia":
-            # UNTESTED!!!
+            # UNTESTED!!! not takes only one child, so we need an or
             s.NOT()
+            s.OR()
             for each in [".mp3", ".pdf", ".wav", "mp4"]:
                 s.addCriterion(
                     operator="endsWithTerm",
                     field="MulOriginalFileTxt",
                     value=each,
                 )
+            s.endConjunction()
+            s.endConjunction()
 
-        s.toFile(path="debug.search.xml")
         # s.print()
         s.validate(mode="search")
-        return self.api.search2(query=s)
+        return s
+
+    def _request(self, method: Callable, **kwargs) -> Any:
+        """
+        Call an MpApi method in one of the request slots (see __init__).
+        """
+        with self._slots:
+            return method(**kwargs)
 
-    def _savedQuery(self, *, Type: str = "Object", ID: int, offset: int = 0) -> Module:
+    def _savedQuery(
+        self,
+        *,
+        Type: str = "Object",
+        ID: int,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> Module:
         """
-        returns the result of a saved query (limited to chunkSize)
+        returns the result of a saved query (limited to chunkSize unless
+        limit is given; use limit=0 to only count the hits)
 
         Is this correct? `Yes, we're calling this from getByType with various offsets.
         Each call returns the object part of the a chunk.
         """
-        ET = self.api.runSavedQuery2(
-            Type=Type, ID=ID, offset=offset, limit=self.chunkSize
+        if limit is None:
+            limit = self.chunkSize
+        ET = self._request(
+            self.api.runSavedQuery2, Type=Type, ID=ID, offset=offset, limit=limit
         )
         return Module(tree=ET)
@@ -17,24 +17,213 @@ SEE ALSO
     http://docs.zetcom.com/ws
 """
 
-# import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
 from lxml import etree  # type: ignore
-from mpapi.constants import NSMAP
+from mpapi.constants import NSMAP, XPATH
+from mpapi.helper import record_size, recorded_size
 from mpapi.search import Search
 from mpapi.module import Module
+import os
 from pathlib import Path  # used only sparingly
-from typing import Union
+import random
+import threading
+import time
+from typing import Callable, Self, Union
 import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 
 # ET: Any
 ETparser = etree.XMLParser(remove_blank_text=True)
 
 
+class CircuitOpen(requests.exceptions.RequestException):
+    """
+    Raised instead of sending a request while the circuit breaker is open,
+    i.e. after too many consecutive failures.
+    """
+
+
+class _UploadFile:
+    """
+    Wraps a file opened in binary mode for streamed uploads: requests gets
+    the Content-Length from __len__ and reads the body block by block. The
+    callback (if any) is called with the size of every block read.
+
+    A retried request seeks back to the start (see MpApi._request) and reads
+    the file again; bytes are only reported once, so the callback's total is
+    the size of the file however many attempts it takes.
+    """
+
+    def __init__(self, f, *, callback: Callable[[int], None] | None = None):
+        self.f = f
+        self.callback = callback
+        self.size = os.fstat(f.fileno()).st_size
+        self._pos = 0  # position in current attempt
+        self._reported = 0
+
+    def __iter__(self):
+        while block := self.read(1024 * 1024):
+            yield block
+
+    def __len__(self) -> int:
+        return self.size
+
+    def read(self, size: int = -1) -> bytes:
+        block = self.f.read(size)
+        self._pos += len(block)
+        if self._pos > self._reported:
+            if self.callback is not None:
+                self.callback(self._pos - self._reported)
+            self._reported = self._pos
+        return block
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._pos = self.f.seek(offset, whence)
+        return self._pos
+
+
+class TransportPolicy:
+    """
+    Timeouts, retries and circuit breaker for MpApi's http requests.
+
+    USAGE
+        policy = TransportPolicy(readTimeout=600, retries=5)
+        client = MpApi(baseURL=baseURL, user=user, pw=pw, policy=policy)
+        ...
+        print(policy.stats)  # Counter with requests, retries, failures ...
+
+    EXPECTS
+    * connectTimeout, readTimeout: in seconds; None waits forever
+    * retries: max number of retries per request (0 = no retries)
+    * backoff: base delay in seconds; the delay before retry n is a random
+      value between 0 and min(maxBackoff, backoff * 2**n) ("full jitter").
+      A Retry-After header sent by the server is honored instead.
+    * retryOn: http status codes that are retried
+    * breakerThreshold: open the circuit breaker after so many consecutive
+      failures; 0 disables the breaker
+    * breakerCooldown: seconds the breaker stays open; afterwards requests
+      are let through again
+
+    While the breaker is open, new requests fail immediately with
+    CircuitOpen. A request that is already retrying (and may have opened the
+    breaker itself) waits for the cooldown instead, so it keeps the rest of
+    its retries.
+
+    Only idempotent requests are retried after timeouts, connection errors
+    and 5xx responses, i.e. GET, PUT, DELETE and searches. Other requests
+    are only retried if the server didn't process them (429, connect
+    timeout).
+
+    One policy object can be shared by several MpApi instances (e.g. in
+    Mink), so stats and the breaker cover all requests to the same server.
+    """
+
+    def __init__(
+        self,
+        *,
+        connectTimeout: float | None = 10,
+        readTimeout: float | None = 300,
+        retries: int = 3,
+        backoff: float = 1,
+        maxBackoff: float = 60,
+        retryOn: tuple[int, ...] = (429, 500, 502, 503, 504),
+        breakerThreshold: int = 0,
+        breakerCooldown: float = 60,
+    ) -> None:
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.retryOn = tuple(retryOn)
+        self.breakerThreshold = breakerThreshold
+        self.breakerCooldown = breakerCooldown
+        self.stats = Counter()
+        self._failures = 0  # consecutive
+        self._openUntil = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fromConf(cls, conf: dict) -> Self:
+        """
+        Make a policy from a dict, e.g. the http table in jobs.toml. Keys are
+        the parameter names of __init__; unknown keys raise a TypeError.
+        """
+        return cls(**conf)
+
+    @property
+    def timeout(self) -> tuple[float | None, float | None]:
+        return (self.connectTimeout, self.readTimeout)
+
+    def delay(self, *, attempt: int, response: requests.Response = None) -> float:
+        """
+        Seconds to wait before retry no. attempt (starting at 0).
+        """
+        if response is not None:
+            retryAfter = response.headers.get("Retry-After", "")
+            if retryAfter.isdigit():
+                return min(float(retryAfter), self.maxBackoff)
+        return random.uniform(0, min(self.maxBackoff, self.backoff * 2**attempt))
+
+    def checkCircuit(self) -> None:
+        """
+        Raises CircuitOpen if the breaker is open; otherwise counts a request.
+        """
+        with self._lock:
+            if time.monotonic() < self._openUntil:
+                self.stats["rejected"] += 1
+                raise CircuitOpen("Circuit breaker open after repeated failures")
+            self.stats["requests"] += 1
+
+    def count(self, key: str) -> None:
+        """
+        Increase stats[key] by one; stats are shared by threads.
+        """
+        with self._lock:
+            self.stats[key] += 1
+
+    def openFor(self) -> float:
+        """
+        Seconds until the breaker closes again; 0 if it's closed.
+        """
+        with self._lock:
+            return max(0.0, self._openUntil - time.monotonic())
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self.stats["failures"] += 1
+            self._failures += 1
+            if self.breakerThreshold and self._failures >= self.breakerThreshold:
+                self._openUntil = time.monotonic() + self.breakerCooldown
+                self._failures = 0
+                self.stats["breakerOpened"] += 1
+                logging.warning(f"Circuit breaker open for {self.breakerCooldown}s")
+
+
 class MpApi:
     def __init__(
-        self, *, baseURL: str, user: str, pw: str, acceptLang: str = "de"
+        self,
+        *,
+        baseURL: str,
+        user: str,
+        pw: str,
+        acceptLang: str = "de",
+        policy: TransportPolicy | None = None,
     ) -> None:
+        """
+        policy: timeouts, retries etc. for all requests; if None, a
+        TransportPolicy with default values is used.
+        """
         self.appURL = baseURL + "/ria-ws/application"
+        if policy is None:
+            policy = TransportPolicy()
+        self.policy = policy
         s = requests.Session()
         s.auth = (user, pw)
         s.headers.update(
@@ -45,28 +234,174 @@ class MpApi:
             }
         )
         self.session = s
+        self._poolSize = DEFAULT_POOLSIZE
+        self._poolLock = threading.Lock()
 
-    def _delete(self, url):
-        r = self.session.delete(url)
-        r.raise_for_status()
-        return r
+    @property
+    def stats(self) -> Counter:
+        """
+        Counts of requests, retries, failures etc. (see TransportPolicy)
+        """
+        return self.policy.stats
+
+    def growPool(self, *, size: int) -> None:
+        """
+        Make the connection pool of the session keep at least size connections
+        per host, so that size threads can share the session without opening
+        and discarding connections. The adapter is only replaced if the pool is
+        too small, so callers with different needs don't undo each other.
+        """
+        with self._poolLock:
+            if size <= self._poolSize:
+                return
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self._poolSize = size
+
+    def _delete(self, url, *, data=None):
+        return self._request("DELETE", url, data=data)
 
     def _get(self, url, *, headers=None, stream=False):
         if headers is None:
             headers = {}
-        r = self.session.get(url, headers=headers)
-        r.raise_for_status()
-        return r
+        return self._request("GET", url, headers=headers, stream=stream)
 
-    def _post(self, url, *, data):
-        r = self.session.post(url, data=data)
-        r.raise_for_status()
-        return r
+    def _post(self, url, *, data, idempotent: bool = False):
+        """
+        Set idempotent=True for POSTs that don't change anything (e.g.
+        searches), so they are retried like GETs.
+        """
+        return self._request("POST", url, data=data, idempotent=idempotent)
+
+    def _put(self, url, *, data, headers=None):
+        return self._request("PUT", url, data=data, headers=headers)
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        *,
+        idempotent: bool | None = None,
+        retries: int | None = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Send a request according to self.policy: with timeouts, retries with
+        backoff and circuit breaker. Raises HTTPError for error responses,
+        just like raise_for_status.
+
+        retries overrides policy.retries, e.g. retries=0 for callers that
+        retry themselves (saveAttachment), so retries don't multiply.
+        """
+        policy = self.policy
+        if idempotent is None:
+            idempotent = method != "POST"
+        if retries is None:
+            retries = policy.retries
+        kwargs.setdefault("timeout", policy.timeout)
+        attempt = 0
+        body = kwargs.get("data")
+        while True:
+            policy.checkCircuit()
+            if hasattr(body, "seek"):  # streamed upload: send from the start
+                body.seek(0)
+            error = None
+            r = None
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                retry = idempotent or isinstance(e, requests.ConnectTimeout)
+            else:
+                if r.status_code not in policy.retryOn:
+                    policy.success()
+                    self._raise_for_status(r)
+                    return r
+                retry = idempotent or r.status_code == 429
+            policy.failure()
+            if not retry or attempt >= retries:
+                if error is not None:
+                    raise error
+                self._raise_for_status(r)
+            # wait for the breaker if it's open, e.g. due to our own failures
+            delay = max(policy.delay(attempt=attempt, response=r), policy.openFor())
+            reason = error if error is not None else r.status_code
+            logging.warning(
+                f"{method} {url} failed ({reason}); retry {attempt + 1} in {delay:.1f}s"
+            )
+            policy.count("retries")
+            if r is not None:
+                r.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _download(
+        self, *, url: str, part: Path, callback: Callable[[int], None] | None
+    ) -> int:
+        """
+        Download url to part; if part exists, continue where it ends. Returns
+        the size of the complete file. Doesn't retry; see saveAttachment.
+
+        A part is only resumed together with the validator (ETag or
+        Last-Modified) of the response it came from, which is kept in the
+        hidden file .{part}.validator. It's sent as If-Range, so the server
+        only sends the rest if the file hasn't changed; otherwise it sends the
+        whole new file. Parts without a validator are downloaded again.
+        """
+        validatorFn = part.with_name(f".{part.name}.validator")
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Accept": "application/octet-stream", "Accept-Encoding": "identity"}
+        if offset:
+            try:
+                headers["If-Range"] = validatorFn.read_text(encoding="utf-8")
+            except FileNotFoundError:
+                offset = 0  # we can't tell if part belongs to the current file
+            else:
+                headers["Range"] = f"bytes={offset}-"
+        try:
+            r = self._request("GET", url, headers=headers, stream=True, retries=0)
+        except requests.HTTPError as e:
+            if offset and e.response.status_code == 416:  # range not satisfiable
+                part.unlink()  # part doesn't fit the file on the server
+                validatorFn.unlink(missing_ok=True)
+                return self._download(url=url, part=part, callback=callback)
+            raise
+        with r:
+            if r.status_code == 206:  # partial content
+                mode = "ab"
+                total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            else:  # new download, file changed or server ignored Range
+                mode = "wb"
+                total = r.headers.get("Content-Length", "")
+                validator = r.headers.get("ETag", "")
+                if not validator or validator.startswith("W/"):  # weak
+                    validator = r.headers.get("Last-Modified", "")
+                if validator:
+                    validatorFn.write_text(validator, encoding="utf-8")
+                else:
+                    validatorFn.unlink(missing_ok=True)
+            with open(part, mode) as f:
+                for chunk in r.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    if callback is not None:
+                        callback(len(chunk))
+        size = part.stat().st_size
+        if total.isdigit() and size != int(total):
+            raise requests.exceptions.ChunkedEncodingError(
+                f"Incomplete download: {size} of {total} bytes"
+            )
+        validatorFn.unlink(missing_ok=True)
+        return size
 
-    def _put(self, url, *, data):
-        r = self.session.put(url, data=data)
+    def _raise_for_status(self, r: requests.Response) -> None:
+        """
+        Like r.raise_for_status, but closes the response first, so that the
+        connection of a streamed response goes back to the pool.
+        """
+        if not r.ok:
+            r.close()
         r.raise_for_status()
-        return r
 
     def _search(self, *, queryET) -> requests.Response:
         """
@@ -74,10 +409,7 @@ class MpApi:
         and returns requests response.
         """
 
-        mtype = queryET.xpath(
-            "/s:application/s:modules/s:module/@name",
-            namespaces={"s": "http://www.zetcom.com/ria/ws/module/search"},
-        )[0]
+        mtype = XPATH["searchModuleName"](queryET)[0]
         if not mtype:
             raise TypeError("Unknown module")
         url = f"{self.appURL}/module/{mtype}/search"
@@ -85,6 +417,7 @@ class MpApi:
         return self._post(
             url,
             data=etree.tostring(queryET),  # encoding="unicode"
+            idempotent=True,
         )
 
     #
@@ -96,7 +429,7 @@ class MpApi:
         """
         url = self.appURL + "/session"
         r = self._get(url)
-        tree = self.ETfromString(xml=r.text)
+        tree = self.ETfromString(xml=r.content)
 
         key = tree.xpath(
             "/s:application/s:session/s:key/text()",
@@ -131,7 +464,7 @@ class MpApi:
         Return the data definition for a single or all modules as Module
         """
         r = self.getDefinition(module=mtype)
-        return Module(xml=r.text)
+        return Module(xml=r.content)
 
     #
     # B.2 SEARCH
@@ -156,7 +489,7 @@ class MpApi:
         </application>
         """
         url = f"{self.appURL}/module/{mtype}/search/savedQuery/{id}"
-        return self._post(url, data=xml)
+        return self._post(url, data=xml, idempotent=True)
 
     def runSavedQuery2(
         self, *, ID: int, Type: str = "Object", limit: int = -1, offset: int = 0
@@ -225,7 +558,7 @@ class MpApi:
         """
         query.validate(mode="search")
         r = self._search(queryET=query.toET())
-        m = Module(xml=r.text)
+        m = Module(xml=r.content)
         # print (f"ACTUAL SIZE: {m.actualSize()}")
         return m
 
@@ -259,8 +592,7 @@ class MpApi:
         object.
         """
         r = self.getItem(module=mtype, id=ID)
-        # print(r.text)
-        return Module(xml=r.text)
+        return Module(xml=r.content)
 
     def createItem(self, *, module: str, xml: str) -> requests.Response:
         """
@@ -293,7 +625,7 @@ class MpApi:
         xml = etree.tostring(ET, pretty_print=True)
         # print(f"{xml=}")
         r = self.createItem(module=mtype, xml=xml)
-        return Module(xml=r.text)
+        return Module(xml=r.content)
 
     def createItem3(self, *, data: Module) -> int:
         """
@@ -304,7 +636,7 @@ class MpApi:
         mtype = data.extract_mtype()
         # print (f"{mtype=}")
         m = self.createItem2(mtype=mtype, data=data)
-        objIdL = m.xpath("/m:application/m:modules/m:module/m:moduleItem/@id")
+        objIdL = XPATH["itemIds"](m.etree)
         if len(objIdL) == 0:
             raise ValueError("Response contains no id")  # should not happen
         if len(objIdL) > 1:
@@ -335,7 +667,7 @@ class MpApi:
         xml = data.toString()
         # print(xml)
         ret = self.updateItem(module=mtype, id=ID, xml=xml)
-        return Module(xml=ret.text)
+        return Module(xml=ret.content)
 
     def updateItem4(self, data: Module) -> requests.Response:
         """
@@ -683,7 +1015,14 @@ class MpApi:
         r = self._get(url, headers={"Accept": "application/octet-stream"})
         return r
 
-    def saveAttachment(self, *, module: str = "Multimedia", id: int, path: str) -> int:
+    def saveAttachment(
+        self,
+        *,
+        module: str = "Multimedia",
+        id: int,
+        path: str,
+        callback: Callable[[int], None] | None = None,
+    ) -> int:
         """
         Streaming version of getAttachment that saves attachment directly to disk.
         Expects
@@ -691,19 +1030,76 @@ class MpApi:
         - id: item id in specified module (int)
         - path: filename/path to save attachment to
         to.
+        - callback (optional): called with the size of every chunk written,
+          e.g. for progress or throttling (see downloader.py)
         Returns id if successful.
         Note: There is a similar saveAttachments in Sar.py that calls this one.
+
+        New
+        - The attachment is written to {path}.part first and renamed to path
+          when it's complete. If the download breaks, it's resumed with a
+          Range request. Broken downloads and retryable responses (see
+          policy.retryOn) are retried up to policy.retries times in total; the
+          request itself isn't retried again by _request. A .part file left from
+          an earlier run is resumed as well, but only if the attachment hasn't
+          changed in the meantime (If-Range, see _download).
+        - The size of the complete file is recorded in .sizes in the same
+          directory, see verifyAttachment.
         """
         url = f"{self.appURL}/module/{module}/{id}/attachment"
-        with self.session.get(
-            url, stream=True, headers={"Accept": "application/octet-stream"}
-        ) as r:
-            r.raise_for_status()
-            with open(path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        path = Path(path)
+        part = path.with_name(path.name + ".part")
+        policy = self.policy
+        attempt = 0
+        while True:
+            r = None
+            try:
+                size = self._download(url=url, part=part, callback=callback)
+            except requests.HTTPError as e:
+                r = e.response
+                if (
+                    r is None
+                    or r.status_code not in policy.retryOn
+                    or attempt >= policy.retries
+                ):
+                    raise
+                key = "retries"
+                reason = r.status_code
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                if attempt >= policy.retries:
+                    raise
+                key = "resumes"
+                reason = e
+            else:
+                break
+            # wait for the breaker if it's open, like _request
+            delay = max(policy.delay(attempt=attempt, response=r), policy.openFor())
+            logging.warning(f"{url} failed ({reason}); retry in {delay:.1f}s")
+            policy.count(key)
+            time.sleep(delay)
+            attempt += 1
+        os.replace(part, path)
+        record_size(path, size)
         return id
 
+    def verifyAttachment(self, *, path: Path | str) -> bool:
+        """
+        Cheap check if an attachment on disk is complete: it has to exist and
+        have the size recorded by saveAttachment. Files without a recorded
+        size (e.g. from older versions) are trusted.
+        """
+        path = Path(path)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return False
+        expected = recorded_size(path)
+        return expected is None or expected == size
+
     def getThumbnail(self, *, module: str, id: int, path: str) -> requests.Response:
         """
         Get the thumbnail of a module item attachment
@@ -713,7 +1109,14 @@ class MpApi:
         r = self._get(url, headers={"Accept": "application/octet-stream"})
         return r  # r.content
 
-    def updateAttachment(self, *, module: str, id: int, path: str) -> requests.Response:
+    def updateAttachment(
+        self,
+        *,
+        module: str,
+        id: int,
+        path: str,
+        callback: Callable[[int], None] | None = None,
+    ) -> requests.Response:
         """
         Add or update the attachment of a module item, as a base64 encoded XML
         Add or update the attachment of a module item, as a binary stream
@@ -723,21 +1126,58 @@ class MpApi:
         When an attachment is uploaded through the gui, the field Dateiname is set
         automatically. This method does not update any fields.
 
-        It's unclear if this version can be streamed and how big the files can be.
-        Currently I am inclined to leave this version be and try out additional
-        version with corresponding numbers i.e. updateAttachment2 etc.
+        New: The file is streamed, i.e. it's not read into memory as a whole,
+        so the size of the file doesn't matter. The optional callback is
+        called with the size of every block that is sent, e.g. for progress.
         """
         url = f"{self.appURL}/module/{module}/{id}/attachment"
+        fn = Path(path).name
+        headers = {"X-File-Name": fn, "Content-Type": "application/octet-stream"}
         with open(path, mode="rb") as f:
-            file = f.read()
+            body = _UploadFile(f, callback=callback)
+            return self._put(url, data=body, headers=headers)
 
-        fn = Path(path).name
+    def updateAttachments(
+        self,
+        *,
+        mapping: dict[int, Path | str],
+        module: str = "Multimedia",
+        workers: int = 4,
+        callback: Callable[[int], None] | None = None,
+    ) -> dict[int, Exception]:
+        """
+        Upload many attachments at the same time.
 
-        # print(f"FN:{fn} {file}")
-        headers = {"X-File-Name": fn, "Content-Type": "application/octet-stream"}
-        r = self.session.put(url, data=file, headers=headers)
-        r.raise_for_status()
-        return r
+        EXPECTS
+        * mapping: {mulId: path}
+        * workers: number of concurrent uploads
+        * callback: like in updateAttachment (shared by all uploads)
+
+        RETURNS
+        * failed uploads as {mulId: exception}; empty if all went well
+        """
+        failed = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    self.updateAttachment,
+                    module=module,
+                    id=ID,
+                    path=path,
+                    callback=callback,
+                ): ID
+                for ID, path in mapping.items()
+            }
+            for future in as_completed(futures):
+                ID = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"upload of {module} {ID} failed: {e}")
+                    failed[ID] = e
+                else:
+                    print(f" uploaded {module} {ID} ({mapping[ID]})")
+        return failed
 
     def deleteAttachment(self, *, module: str, id: int) -> requests.Response:
         """
@@ -766,7 +1206,7 @@ class MpApi:
         Although we treat the response as module data, it seems to work.
         """
         r = self.getOrgUnits(module=mtype)
-        return Module(xml=r.text)
+        return Module(xml=r.content)
 
     #
     # EXPORT aka report -> LATER
@@ -1127,8 +1567,14 @@ class MpApi:
     # HELPERS
     #
 
-    def ETfromString(self, *, xml: str) -> etree:
-        return etree.fromstring(bytes(xml, "UTF-8"))
+    def ETfromString(self, *, xml: str | bytes) -> etree:
+        """
+        Prefer bytes (e.g. r.content) to avoid decoding and encoding the
+        response again.
+        """
+        if isinstance(xml, str):
+            xml = xml.encode("UTF-8")
+        return etree.fromstring(xml)
 
     def toFile(self, *, xml: str, path: str) -> None:
         with open(path, "w", encoding="UTF-8") as f:
@@ -18,6 +18,118 @@ NSMAP = {
 parser = etree.XMLParser(remove_blank_text=True)
 
 
+def _compile(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=NSMAP)
+
+
+# Precompiled xpath expressions for the fixed paths we use all the time, so
+# that we don't pay the parse cost on every call. Use xpath variables instead
+# of f-strings, e.g.
+#   XPATH["itemsByType"](doc, mtype="Object")
+# Ad-hoc paths passed to Helper.xpath are cached separately (see helper.py).
+_approvalSMB = """m:repeatableGroup[
+        @name = 'MulApprovalGrp'
+    ]/m:repeatableGroupItem[
+        m:vocabularyReference[@name = 'TypeVoc']/m:vocabularyReferenceItem[@name = 'SMB-digital']
+        and m:vocabularyReference[@name = 'ApprovalVoc']/m:vocabularyReferenceItem[@name = 'Ja']
+    ]"""
+
+XPATH = {
+    # module
+    "modules": _compile("/m:application/m:modules"),
+    "moduleL": _compile("/m:application/m:modules/m:module"),
+    "module": _compile("/m:application/m:modules/m:module[@name = $mtype]"),
+    "mtypes": _compile("/m:application/m:modules/m:module/@name"),
+    "totalSize": _compile(
+        "/m:application/m:modules/m:module[@name = $mtype]/@totalSize"
+    ),
+    "items": _compile("/m:application/m:modules/m:module/m:moduleItem"),
+    "itemsByType": _compile(
+        "/m:application/m:modules/m:module[@name = $mtype]/m:moduleItem"
+    ),
+    "itemCount": _compile("count(/m:application/m:modules/m:module/m:moduleItem)"),
+    "itemCountByType": _compile(
+        "count(/m:application/m:modules/m:module[@name = $mtype]/m:moduleItem)"
+    ),
+    "itemIds": _compile("/m:application/m:modules/m:module/m:moduleItem/@id"),
+    "firstId": _compile("/m:application/m:modules/m:module/m:moduleItem[1]/@id"),
+    "hasAttachments": _compile(
+        "/m:application/m:modules/m:module/m:moduleItem/@hasAttachments"
+    ),
+    "uuid": _compile("//m:*[@uuid]"),
+    "repeatableGroupsByName": _compile("//m:repeatableGroup[@name = $name]"),
+    # relative to document or moduleItem
+    "refItems": _compile(".//m:moduleReference/m:moduleReferenceItem"),
+    "relatedIds": _compile(
+        "//m:moduleReference[@targetModule = $target]/m:moduleReferenceItem/@moduleItemId"
+    ),
+    # relative to moduleItem or other parent
+    "dataField": _compile("m:dataField[@name = $name]"),
+    "moduleReference": _compile("m:moduleReference[@name = $name]"),
+    "refItemCount": _compile("count(m:moduleReferenceItem)"),
+    "repeatableGroup": _compile("m:repeatableGroup[@name = $name]"),
+    "vocabularyReference": _compile("m:vocabularyReference[@name = $name]"),
+    "vocabularyReferenceItem": _compile("m:vocabularyReferenceItem[@name = $name]"),
+    "lastModified": _compile(
+        "translate(m:systemField[@name ='__lastModified']/m:value,'-:.TZ ','')"
+    ),
+    "dateiname": _compile("m:dataField[@name = 'MulOriginalFileTxt']/m:value/text()"),
+    # Multimedia items with approval (Freigabe) for SMB-digital
+    "mulApproved": _compile(
+        f"""/m:application/m:modules/m:module[
+            @name = 'Multimedia'
+        ]/m:moduleItem[{_approvalSMB}]"""
+    ),
+    "mulApprovedWithAttachment": _compile(
+        f"""/m:application/m:modules/m:module[
+            @name = 'Multimedia'
+        ]/m:moduleItem[
+            @hasAttachments = 'true' and {_approvalSMB}
+        ]"""
+    ),
+    "mulApprovedWithAttachmentSince": _compile(
+        f"""/m:application/m:modules/m:module[
+            @name = 'Multimedia'
+        ]/m:moduleItem[
+            @hasAttachments = 'true' and {_approvalSMB}
+            and m:systemField[
+                @name = '__lastModified'
+                and substring(translate(m:value,'-:.TZ ',''),0, 14) >
+                substring(translate($since,'-:.TZ ',''), 0, 14)
+            ]
+        ]"""
+    ),
+    # Object items that have approval for SMB-digital
+    "objApproved": _compile(
+        """/m:application/m:modules/m:module[
+            @name = $mtype]/m:moduleItem[
+            @id = $ID]/m:repeatableGroup[
+            @name = 'ObjPublicationGrp']/m:repeatableGroupItem[
+                m:vocabularyReference[@name='PublicationVoc']/m:vocabularyReferenceItem[@name='Ja']
+                and m:vocabularyReference[@name='TypeVoc']/m:vocabularyReferenceItem[@id = 2600647]
+            ]"""
+    ),
+    # mulIds of all Multimedia items that are Standardbild of some Object
+    "thumbnailIds": _compile(
+        """/m:application/m:modules/m:module[
+            @name = 'Object'
+        ]/m:moduleItem/m:moduleReference[
+            @name = 'ObjMultimediaRef'
+        ]/m:moduleReferenceItem[
+            m:dataField[@name = 'ThumbnailBoo'][m:value = 'true']
+        ]/@moduleItemId"""
+    ),
+    # search
+    "searchModuleName": _compile("/s:application/s:modules/s:module/@name"),
+    "search": _compile("/s:application/s:modules/s:module/s:search"),
+    "expert": _compile("/s:application/s:modules/s:module/s:search/s:expert"),
+    "select": _compile("/s:application/s:modules/s:module/s:search/s:select"),
+    # vocabulary
+    "vocNodes": _compile("//v:node"),
+    "vocCount": _compile("count(//v:node|/v:instance)"),
+}
+
+
 # not exactly a constant, but dont know where else to put this function
 def get_credentials() -> tuple[str, str, str]:
     cred_fn = Path.home() / ".ria"
@@ -0,0 +1,164 @@
+"""
+Downloader - saves many attachments at the same time
+
+USAGE
+    dl = Downloader(api=api, workers=4, bandwidth=10_000_000)
+    jobs = [(ID, path), ...]  # mulId and target path
+    report = dl.run(jobs=jobs)
+    print(report["failed"])
+
+Attachments are downloaded by a pool of worker threads that share the
+connection pool of api.session (see MpApi.growPool). perHost limits the number
+of concurrent downloads, i.e. of connections to the host (default: workers).
+bandwidth caps the aggregated download rate in bytes per second; None means
+no cap.
+
+The Downloader doesn't decide what to download or how files are named;
+that's the job of the caller (e.g. GetAttachments with its naming policies,
+Sar.saveAttachments). It only downloads.
+
+While running, a progress line is printed for every finished file with the
+current throughput. run returns a report with the number of files and bytes,
+the seconds it took and the failed jobs. A failed download doesn't stop the
+other downloads; it's logged and reported. If run is interrupted (e.g. by
+Ctrl-C), downloads that haven't started yet are cancelled and the running
+ones are left to finish in the background; incomplete files remain as .part
+files.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+from mpapi.client import MpApi
+from pathlib import Path
+import threading
+import time
+from typing import Iterable
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket: take(n) blocks until n tokens (bytes) are
+    available. The bucket is refilled with rate tokens per second and holds
+    at most a tenth of a second worth of tokens, so bursts stay small.
+    """
+
+    def __init__(self, *, rate: float) -> None:
+        self.rate = rate
+        self.capacity = rate / 10
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, n: int) -> None:
+        with self._lock:  # waiting in the lock serves the threads in turn
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= n
+            if self._tokens < 0:
+                time.sleep(-self._tokens / self.rate)
+
+
+class Downloader:
+    def __init__(
+        self,
+        *,
+        api: MpApi,
+        workers: int = 4,
+        perHost: int | None = None,
+        bandwidth: float | None = None,
+    ) -> None:
+        """
+        EXPECTS
+        * api: MpApi client; its session is used for all downloads
+        * workers: number of concurrent downloads
+        * perHost: max number of connections per host (default: workers)
+        * bandwidth: max bytes per second for all downloads together
+        """
+        self.api = api
+        self.workers = workers
+        self.perHost = perHost if perHost is not None else workers
+        self.bucket = TokenBucket(rate=bandwidth) if bandwidth else None
+        self.api.growPool(size=min(self.workers, self.perHost))
+        self._slots = threading.BoundedSemaphore(max(self.perHost, 1))
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def run(
+        self, *, jobs: Iterable[tuple[int, Path]], module: str = "Multimedia"
+    ) -> dict:
+        """
+        Download attachments of the items in jobs, a list of (ID, path)
+        tuples. Existing files are overwritten, so check before adding them.
+
+        RETURNS
+        * report: {"files": int, "bytes": int, "seconds": float,
+          "failed": [(ID, path, error)]}
+        """
+        jobs = list(jobs)
+        self._bytes = 0
+        self._start = start = time.monotonic()
+        failed = []
+        files = 0
+        if not jobs:
+            return {"files": 0, "bytes": 0, "seconds": 0.0, "failed": failed}
+        print(f"* downloading {len(jobs)} attachments with {self.workers} workers")
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {
+                executor.submit(self._download, module=module, ID=ID, path=path): (
+                    ID,
+                    path,
+                )
+                for ID, path in jobs
+            }
+            for future in as_completed(futures):
+                ID, path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"attachment {module} {ID} failed: {e}")
+                    failed.append((ID, path, e))
+                else:
+                    files += 1
+                self._progress(done=files + len(failed), total=len(jobs), path=path)
+        finally:
+            # don't wait for the queue if we are interrupted
+            executor.shutdown(wait=False, cancel_futures=True)
+        seconds = time.monotonic() - start
+        print(
+            f"* {files} attachments, {self._bytes / 1e6:.1f} MB in {seconds:.1f}s"
+            f" ({self._bytes / 1e6 / max(seconds, 0.001):.2f} MB/s), {len(failed)} failed"
+        )
+        return {
+            "files": files,
+            "bytes": self._bytes,
+            "seconds": seconds,
+            "failed": failed,
+        }
+
+    #
+    # private
+    #
+
+    def _count(self, n: int) -> None:
+        """
+        Called for every chunk that is written to disk.
+        """
+        if self.bucket is not None:
+            self.bucket.take(n)
+        with self._lock:
+            self._bytes += n
+
+    def _download(self, *, module: str, ID: int, path: Path) -> None:
+        # incomplete downloads are left as .part files, see saveAttachment
+        with self._slots:
+            self.api.saveAttachment(
+                module=module, id=ID, path=path, callback=self._count
+            )
+
+    def _progress(self, *, done: int, total: int, path: Path) -> None:
+        seconds = max(time.monotonic() - self._start, 0.001)
+        print(f"  [{done}/{total}] {path} ({self._bytes / 1e6 / seconds:.2f} MB/s)")
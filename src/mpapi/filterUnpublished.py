@@ -1,22 +1,26 @@
 """
 quick and dirty commandline utitly for ccc portal. It reads in a series of zipped chunks,
-unpacks them, filters out Multimedia items that are freigegeben, but still not available
+filters out Multimedia items that are freigegeben, but still not available
 on recherche.smb.museum.
 
+Chunks are streamed from zip to zip, i.e. they are neither extracted to disk
+nor parsed as a whole. The rules which items are removed are in
+data/filter.toml; use --rules to use your own.
+
 pdf werden nicht auf recherche angezeigt, selbst wenn diese Assets eine Freigabe haben.
 tif werden als jpg angezeigt, wenn sie entsprechende Freigabe haben.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import logging
-
-# from lxml import etree  # type: ignore
-from mpapi.constants import NSMAP
-from mpapi.module import Module
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+from mpapi.itemFilter import ItemFilter
 from pathlib import Path
 import re
 import sys
 from typing import Iterable
-from zipfile import ZipFile
 
 
 def iter_chunks(src: Path) -> Iterable[Path]:
@@ -39,11 +43,20 @@ def iter_chunks(src: Path) -> Iterable[Path]:
         chunkFn = Path(parent / f"{beginning}-chunk{no}{tail}")
 
 
-def filter_(src: str, force: bool = False) -> None:
+def filter_(
+    src: str, force: bool = False, jobs: int = 1, rules: str | None = None
+) -> None:
     """
     Expect chunks like this
 
     C:/m3/MpApi/sdata/CCC/cccall/20240610/query767070-chunk1.zip
+
+    NEW: With jobs > 1, chunks are filtered in a pool of that many processes.
+    The output is the same; log records of the workers are passed to the main
+    process which writes them to filter.log.
+
+    NEW: Which items get removed is declared in a toml file (see itemFilter.py);
+    without rules, the default rules (data/filter.toml) are used.
     """
     src = Path(src)
     target_dir = src.parent.parent / f"{src.parent.name}" / "filter"
@@ -51,33 +64,30 @@ def filter_(src: str, force: bool = False) -> None:
         target_dir.mkdir(parents=True)
     print(f"{target_dir=}")
     _init_log(target_dir)
-    src_dir = src.parent
-    for src_zip in iter_chunks(src):
-        member = Path(src_zip).with_suffix(".xml").name
-        temp_fn = src_dir / member
-        target_fn = target_dir / member
-        target_zip = target_fn.with_suffix(".zip")
-        # print(f"{target_dir=}")
-        # print(f"{target_fn=}")
-        # print(f"{target_zip=}")
-        # print(f"{member=}")
-        # print(f"{src_zip=}")
-        # if src_zip.exists():
-        # print("src_zip exists")
-        # else:
-        # print("src_zip DOES NOT exists")
-
-        if not target_zip.exists() or force:
-            if not temp_fn.exists():
-                with ZipFile(src_zip, "r") as zippy:
-                    print("unzipping...")
-                    zippy.extractall(src_dir)
-            m = _unpublished(data=Module(file=temp_fn))
-            m = _only_em(data=m)
-            m.toZip(path=target_fn)
-        if temp_fn.with_suffix(".zip").exists() and temp_fn.exists():
-            print("unlinking temp file")
-            temp_fn.unlink()
+    if jobs > 1:
+        queue = multiprocessing.Queue()
+        listener = QueueListener(queue, *logging.getLogger().handlers)
+        listener.start()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_worker, initargs=(queue,)
+            ) as executor:
+                chunks = iter_chunks(src)
+                # list: raises the first exception from a worker
+                list(
+                    executor.map(
+                        _filter_chunk,
+                        chunks,
+                        repeat(target_dir),
+                        repeat(force),
+                        repeat(rules),
+                    )
+                )
+        finally:
+            listener.stop()
+    else:
+        for src_zip in iter_chunks(src):
+            _filter_chunk(src_zip, target_dir, force, rules)
 
 
 #
@@ -85,6 +95,25 @@ def filter_(src: str, force: bool = False) -> None:
 #
 
 
+def _filter_chunk(
+    src_zip: Path, target_dir: Path, force: bool, rules: Path | None = None
+) -> None:
+    """
+    Filter a single chunk; runs in a worker process if filter_ has jobs > 1.
+
+    moduleItems are streamed from the zipped chunk into the target zip (see
+    ItemFilter.filterFile), so memory and disk usage don't depend on the size
+    of the chunk.
+    """
+    target_zip = target_dir / Path(src_zip).name
+    if target_zip.exists() and not force:
+        return
+    print(f"filtering {src_zip}")
+    itemFilter = ItemFilter.fromFile(rules) if rules else ItemFilter.default()
+    removed = itemFilter.filterFile(src=src_zip, target=target_zip)
+    print(f"{removed} items removed")
+
+
 def _analyze_chunkFn(src: Path) -> tuple[Path, str, int, str]:
     """
     split path into four components.
@@ -114,51 +143,10 @@ def _init_log(target_dir: Path) -> None:
     log.addHandler(logging.StreamHandler(sys.stdout))
 
 
-def _only_em(*, data: Module) -> Module:
-    """
-    drop moduleItems that are have verwaltendeInstituion = Ethnologisches Museum
+def _init_worker(queue: multiprocessing.Queue) -> None:
     """
-    xpath = """/m:application/m:modules/m:module[
-        @name = 'Object'
-    ]/m:moduleItem[
-        m:moduleReference[
-            @name ='ObjOwnerRef'
-        ]/m:moduleReferenceItem/m:formattedValue[
-            @language='de'
-        ] != 'Ethnologisches Museum, Staatliche Museen zu Berlin'
-    ]"""
-    for itemN in data.xpath(xpath):
-        inst = itemN.xpath(
-            "m:moduleReference[@name ='ObjOwnerRef']/m:moduleReferenceItem/m:formattedValue/text()",
-            namespaces=NSMAP,
-        )[0]
-        print(f"Unlinking object with verwaltendeInstituion != EM {inst}")
-        itemN.getparent().remove(itemN)
-    return data
-
-
-def _unpublished(*, data: Module) -> Module:
+    Send all log records of a worker process to the main process.
     """
-    src_xml is the path to the unpacked xml file
-    target_dir is the path to the target directory
-
-    The respective Multimedia moduleItems get deleted, the entry in moduleReferenceItem
-    remain...
-    """
-    for itemN in data.xpath("""/m:application/m:modules/m:module[
-        @name = 'Multimedia'
-        ]/m:moduleItem"""):
-        # print(f"{itemN=}")zu
-        dateinameL = itemN.xpath(
-            """m:dataField[
-            @name = 'MulOriginalFileTxt'
-        ]/m:value/text()""",
-            namespaces=NSMAP,
-        )
-        if len(dateinameL) > 0 and dateinameL[0].endswith(
-            (".mp3", ".pdf", "mp4", ".wav")
-        ):
-            mulId = itemN.xpath("@id")[0]
-            logging.info(f"DEL {mulId} {dateinameL[0]}")
-            itemN.getparent().remove(itemN)
-    return data
+    log = logging.getLogger()
+    log.handlers = [QueueHandler(queue)]
+    log.setLevel(logging.DEBUG)
@@ -9,6 +9,8 @@ Configuration file format (where | indicates the possible options):
     label = "alabel"
     attachments.restriction = "keine" | "freigegeben"
     attachments.name = "dateiname" | "mulid" | "Cornelia"
+    attachments.workers = 4 # optional: concurrent downloads (default 4)
+    attachments.bandwidth = 10 # optional: max MB/s for all downloads
 
     keine : download the attachments from all assets
     freigegeben : download only assets which are freigegeben for SMB-Digital
@@ -24,6 +26,8 @@ will put attachments in dir
     ./label/20220708/pix
 where the current date is used for the second directory.
 
+pix.zip is updated incrementally: only new or changed files are appended.
+
 NEW
 - 21.7.2024: We're using the downloaded data from MpApi as the cache, so we dont
     have to d/n same stuff again.
@@ -31,16 +35,32 @@ NEW
 
 from datetime import date
 from lxml import etree
-from mpapi.client import MpApi
-from mpapi.constants import get_credentials, load_conf
+from mpapi.client import MpApi, TransportPolicy
+from mpapi.downloader import Downloader
+from mpapi.constants import XPATH, get_credentials, load_conf
 from mpapi.module import Module
 from mpapi.search import Search
 from pathlib import Path
+import os
 import shutil
 import zipfile
 
 conf_fn = "jobs.toml"
 NSMAP = {"m": "http://www.zetcom.com/ria/ws/module"}
+# formats that are compressed already; deflating them again only costs time
+stored = {
+    ".gif",
+    ".jpeg",
+    ".jpg",
+    ".mp3",
+    ".mp4",
+    ".pdf",
+    ".png",
+    ".tif",
+    ".tiff",
+    ".webp",
+    ".zip",
+}
 
 
 def get_attachment(client: MpApi, ID: int) -> None:
@@ -56,16 +76,11 @@ def get_attachment(client: MpApi, ID: int) -> None:
     # we need the dateiname to save, assuming there can be only one.
     m = client.getItem2(mtype="Multimedia", ID=ID)
     # m.toFile(path=f"debug.multimedia{ID}")
-    if (
-        m.xpath("/m:application/m:modules/m:module/m:moduleItem/@hasAttachments")[0]
-        != "true"
-    ):
+    if XPATH["hasAttachments"](m.etree)[0] != "true":
         raise ValueError("ERROR: Record has no attachment")
 
     try:
-        fn = m.xpath(
-            "/m:application/m:modules/m:module/m:moduleItem/m:dataField[@name='MulOriginalFileTxt']/m:value/text()"
-        )[0]
+        fn = XPATH["dateiname"](XPATH["items"](m.etree)[0])[0]
     except Exception:
         fn = f"{ID}.jpg"  # use mulId as a fallback if no dateiname in RIA
         print("WARNING: Falling back to {fn} since no Dateiname specified in RIA")
@@ -74,13 +89,97 @@ def get_attachment(client: MpApi, ID: int) -> None:
     client.saveAttachment(id=ID, path=fn)
 
 
+def update_zip(*, src: Path, zip_path: Path) -> int:
+    """
+    Add new or changed files in src (recursively) to the zip file at
+    zip_path; create it if it doesn't exist. Files are compared by size and
+    modification time (which zip stores in steps of 2 seconds). Already
+    compressed formats (see stored) are stored without compression. Dotfiles
+    (like .sizes) and incomplete downloads (*.part) are skipped.
+
+    New files are appended to the existing zip. If files have changed, which
+    should be rare, the zip is rewritten once: unchanged entries are copied,
+    changed files are written anew, so every name occurs only once.
+
+    RETURNS
+    * number of files added or replaced
+    """
+    known = {}
+    if zip_path.exists():
+        with zipfile.ZipFile(zip_path, "r") as zf:
+            known = {info.filename: info for info in zf.infolist()}
+
+    new = []  # (path, arcname)
+    changed = {}  # arcname: path
+    for path in sorted(src.rglob("*")):
+        rel = path.relative_to(src)
+        if (
+            not path.is_file()
+            or path.suffix == ".part"
+            or any(part.startswith(".") for part in rel.parts)
+        ):
+            continue
+        arcname = rel.as_posix()
+        old = known.get(arcname)
+        if old is None:
+            new.append((path, arcname))
+        elif not _zip_current(old=old, path=path):
+            changed[arcname] = path
+
+    if changed:
+        temp = zip_path.with_name(f".{zip_path.name}.tmp")
+        with (
+            zipfile.ZipFile(zip_path, "r") as old_zf,
+            zipfile.ZipFile(temp, "w") as zf,
+        ):
+            for info in old_zf.infolist():
+                if info.filename in changed:
+                    _zip_write(
+                        zf=zf, path=changed[info.filename], arcname=info.filename
+                    )
+                else:
+                    copy = zipfile.ZipInfo(info.filename, info.date_time)
+                    copy.compress_type = info.compress_type
+                    copy.external_attr = info.external_attr
+                    copy.file_size = info.file_size  # zip64 for large entries
+                    with old_zf.open(info) as f_in, zf.open(copy, "w") as f_out:
+                        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            for path, arcname in new:
+                _zip_write(zf=zf, path=path, arcname=arcname)
+        os.replace(temp, zip_path)
+    elif new:
+        with zipfile.ZipFile(zip_path, "a") as zf:
+            for path, arcname in new:
+                _zip_write(zf=zf, path=path, arcname=arcname)
+    return len(new) + len(changed)
+
+
+def _zip_current(*, old: zipfile.ZipInfo, path: Path) -> bool:
+    """
+    True if the zip entry old is (most likely) the same as the file at path.
+    DOS timestamps in zip files only have even seconds.
+    """
+    info = zipfile.ZipInfo.from_file(path)
+    date_time = info.date_time[:5] + (info.date_time[5] // 2 * 2,)
+    return old.file_size == info.file_size and old.date_time == date_time
+
+
+def _zip_write(*, zf: zipfile.ZipFile, path: Path, arcname: str) -> None:
+    if path.suffix.lower() in stored:
+        compress_type = zipfile.ZIP_STORED
+    else:
+        compress_type = zipfile.ZIP_DEFLATED
+    zf.write(path, arcname, compress_type=compress_type)
+
+
 class GetAttachments:
     def __init__(
         self, *, job: str, cache: str | None = None, force: bool = False
     ) -> None:
         user, pw, baseURL = get_credentials()
-        self.api = MpApi(baseURL=baseURL, user=user, pw=pw)
         self.conf = self.setup_conf(job)
+        policy = TransportPolicy.fromConf(self.conf["http"])
+        self.api = MpApi(baseURL=baseURL, user=user, pw=pw, policy=policy)
         self.job = job
         self.force = force
         # default for saving new request
@@ -124,34 +223,17 @@ class GetAttachments:
         no = data.actualSize(module="Multimedia")
         print(f"* {no} assets found")
         out_dir = self._get_out_dir()
+        if self.conf["attachments"]["name"] == "Cornelia":
+            # one query for all assets instead of one per asset
+            self.thumbnails = set(XPATH["thumbnailIds"](data.etree))
+            print(f"* {len(self.thumbnails)} Standardbilder found")
 
         print(f"* restriction:{self.conf['attachments']['restriction']}*")
         match self.conf["attachments"]["restriction"]:
             case "keine":
-                moduleItemsL = data.xpath(f"""
-                /m:application/m:modules/m:module[
-                    @name = 'Multimedia'
-                ]/m:moduleItem""")
+                moduleItemsL = XPATH["itemsByType"](data.etree, mtype="Multimedia")
             case "freigegeben":
-                moduleItemsL = data.xpath(f"""
-                /m:application/m:modules/m:module[
-                    @name = 'Multimedia'
-                ]/m:moduleItem[
-                    m:repeatableGroup[
-                        @name = 'MulApprovalGrp'
-                    ]/m:repeatableGroupItem[
-                        m:vocabularyReference[
-                            @name='TypeVoc'
-                        ]/m:vocabularyReferenceItem[
-                            @name = 'SMB-digital' 
-                        ] 
-                    and m:vocabularyReference[
-                        @name='ApprovalVoc'
-                        ]/m:vocabularyReferenceItem[
-                            @name = 'Ja' 
-                        ]
-                    ]
-                ]""")
+                moduleItemsL = XPATH["mulApproved"](data.etree)
             case _:
                 raise Exception(
                     f"Unknown restriction in configuration {self.conf['attachments']['restriction']}"
@@ -161,20 +243,32 @@ class GetAttachments:
                 # raise SyntaxError("Stop here")
         print(f"* About to loop thru {len(moduleItemsL)} assets.")
 
+        jobs = []
         for itemN in moduleItemsL:
             ID = itemN.get("id")
             if itemN.get("hasAttachments") == "true":
-                self._get_single_attachment(item=itemN, ID=ID, out_dir=out_dir)
+                path = self._get_single_attachment(item=itemN, ID=ID, out_dir=out_dir)
+                if path is not None:
+                    jobs.append((ID, path))
             else:
                 print(f"*  mulId {ID} no attachment")
 
+        bandwidth = self.conf["attachments"].get("bandwidth")  # MB/s
+        dl = Downloader(
+            api=self.api,
+            workers=self.conf["attachments"].get("workers", 4),
+            bandwidth=bandwidth * 1_000_000 if bandwidth else None,
+        )
+        try:
+            dl.run(jobs=jobs)
+        except KeyboardInterrupt:
+            print("Catch keyboard interupt")
+
         # out_dir: {jobDir}/yyyymmdd/pix
         out_zip = out_dir.parent / "pix.zip"
-        if self.force or not out_zip.exists():
-            print("zipping pix directory")
-            shutil.make_archive(out_dir, "zip", out_dir)
-        else:
-            print(f"Zip file '{out_zip}' exists already and force is off")
+        print(f"* updating {out_zip}")
+        added = update_zip(src=out_dir, zip_path=out_zip)
+        print(f"* {added} files added to zip")
         # Do we delete the original folder automatically?
         # Since I am undecided, we leave it for now.
 
@@ -242,6 +336,8 @@ class GetAttachments:
             except Exception:
                 raise SyntaxError(f"Config value {each} missing!")
 
+        # optional transport policy like in mink
+        job_data["http"] = config_data.get("http", {}) | job_data.get("http", {})
         # print(f"   {job_data=}")
         return job_data
 
@@ -257,12 +353,9 @@ class GetAttachments:
         Falls back to {mulId}.jpg if no dateiname exists with a warning to STDOUT.
         """
         try:
-            dateiname = item.xpath(
-                "./m:dataField[@name='MulOriginalFileTxt']/m:value/text()",
-                namespaces=NSMAP,
-            )[0]
+            dateiname = XPATH["dateiname"](item)[0]
         except Exception:
-            ID = item.xpath("@id")[0]
+            ID = item.get("id")
             dateiname = f"{ID}.jpg"  # use mulId as a fallback if no dateiname in RIA
             # there is a chance that this file is no jpg
             print(
@@ -280,18 +373,20 @@ class GetAttachments:
             field="ObjObjectGroupsRef.__id",
             value=str(grpId),
         )
-        # would speed up query a lot, but we cant get it to work!
-        # qu.addField(field="ObjMultimediaRef")
-        # qu.addField(field="ObjMultimediaRef.moduleReferenceItem")
-        # qu.addField(field="ObjMultimediaRef.moduleReferenceItem.dataField.ThumbnailBoo")
+        # we only need to know which media are Standardbild
+        qu.addField(field="ObjMultimediaRef.moduleReferenceItem.dataField.ThumbnailBoo")
         qu.validate(mode="search")
         print(f"* about to execute query\n{qu.toString()}")
         return self.api.search2(query=qu)
 
-    def _get_single_attachment(self, *, item, ID: int, out_dir: Path) -> None:
+    def _get_single_attachment(self, *, item, ID: int, out_dir: Path) -> Path | None:
         """
-        Downloads a single attachment. Respects naming policy from configuration
-        and force (without force no overwriting of existing files).
+        Determines the path for a single attachment. Respects naming policy
+        from configuration and force (without force no overwriting of
+        existing files).
+
+        Returns the path if the attachment needs to be downloaded, else None.
+        The download itself is done by process_response's Downloader.
         """
         dateiname = self._get_dateiname(item)  # may fail if no attachment
         suffix = Path(dateiname).suffix
@@ -300,18 +395,7 @@ class GetAttachments:
 
         match self.conf["attachments"]["name"]:
             case "Cornelia":
-                res = self.data.xpath(f"""
-                /m:application/m:modules/m:module[
-                    @name = 'Object'
-                ]/m:moduleItem/m:moduleReference[
-                    @name = 'ObjMultimediaRef'
-                ]/m:moduleReferenceItem[
-                    @moduleItemId =  {ID}
-                ]/m:dataField[
-                    @name = 'ThumbnailBoo'
-                ][m:value = 'true']""")
-                # print(f"xxxxxxxxxxxxxxxx {res=}")
-                if len(res) > 0:
+                if str(ID) in self.thumbnails:
                     out_dir2 = out_dir / "Standardbild"
                 else:
                     out_dir2 = out_dir / "nichtStandardbild"
@@ -325,14 +409,13 @@ class GetAttachments:
             case _:
                 raise SyntaxError(f"Error: Unknown config value: {self.conf['name']}")
 
-        if not path.exists() or self.force:  # let's not overwrite existing files
+        # let's not overwrite existing files, unless they are incomplete
+        if self.force or not self.api.verifyAttachment(path=path):
             print(f"\t{path} {self.force=}")
-            try:
-                self.api.saveAttachment(id=ID, path=path)
-            except KeyboardInterrupt:
-                print("Catch keyboard interupt")
+            return path
         else:
             print("\tfile exists already on disk and force off")
+            return None
 
     def _get_out_dir(self) -> Path:
         """
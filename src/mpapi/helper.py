@@ -1,8 +1,10 @@
+from copy import deepcopy
+from functools import lru_cache
 from lxml import etree
 from mpapi.constants import NSMAP
 from pathlib import Path
 import pkgutil
-from typing import Union
+import threading
 from zipfile import ZipFile, ZIP_LZMA
 
 # from typing import Any
@@ -11,6 +13,103 @@ from zipfile import ZipFile, ZIP_LZMA
 ET = any
 
 
+@lru_cache(maxsize=256)
+def compile_xpath(path: str) -> etree.XPath:
+    """
+    Compile an ad-hoc xpath expression (with our namespace prefixes) and keep
+    it in an LRU cache, so repeated calls with the same path don't parse it
+    again. For fixed paths see XPATH in constants.py.
+    """
+    return etree.XPath(path, namespaces=NSMAP)
+
+
+XSD = {
+    "module": "data/xsd/module_1_6.xsd",
+    "search": "data/xsd/search_1_8.xsd",
+    "voc": "data/xsd/vocabulary_1_1.xsd",
+}
+
+_schemas = threading.local()  # one set of compiled schemas per thread
+
+
+def get_schema(mode: str = "module") -> etree.XMLSchema:
+    """
+    Returns the compiled XMLSchema for mode ("module", "search" or "voc").
+    The xsd is read and compiled only on first use; after that the same
+    object is returned. We keep one object per thread since lxml's schema
+    objects carry their error log with them.
+    """
+    try:
+        xsd = XSD[mode]
+    except KeyError:
+        raise TypeError("Unknown validation mode")
+    cache = _schemas.__dict__
+    if mode not in cache:
+        cache[mode] = etree.XMLSchema(etree.fromstring(pkgutil.get_data(__name__, xsd)))
+    return cache[mode]
+
+
+def validate_item(itemN: ET, *, mtype: str | None = None) -> True:
+    """
+    Validates a single moduleItem against the module schema, e.g. while
+    streaming items, without having to validate the whole document.
+
+    We wrap a copy of the item in a minimal application/modules/module
+    skeleton. If mtype is not given, we take it from the module itemN is in.
+    Dies if the item doesn't validate.
+    """
+    if mtype is None:
+        mtype = itemN.getparent().get("name")
+    m = "{%s}" % NSMAP["m"]
+    appN = etree.Element(f"{m}application", nsmap={None: NSMAP["m"]})
+    modulesN = etree.SubElement(appN, f"{m}modules")
+    moduleN = etree.SubElement(modulesN, f"{m}module", name=mtype)
+    moduleN.append(deepcopy(itemN))
+    get_schema("module").assertValid(appN)
+    return True
+
+
+_sizesLock = threading.Lock()
+_sizesCache: dict = {}  # path of .sizes file: (mtime, {name: size})
+
+
+def record_size(path: Path | str, size: int) -> None:
+    """
+    Remember the size of a completely downloaded file in the append-only file
+    .sizes in the same directory (one "name<TAB>size" per line; later lines
+    win). See recorded_size.
+    """
+    path = Path(path)
+    with _sizesLock:
+        with open(path.parent / ".sizes", "a", encoding="utf-8") as f:
+            f.write(f"{path.name}\t{size}\n")
+
+
+def recorded_size(path: Path | str) -> int | None:
+    """
+    Returns the size recorded for path with record_size or None. The .sizes
+    file is parsed only again when it has changed.
+    """
+    path = Path(path)
+    fn = path.parent / ".sizes"
+    with _sizesLock:
+        try:
+            mtime = fn.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = _sizesCache.get(fn)
+        if cached is None or cached[0] != mtime:
+            sizes = {}
+            with open(fn, encoding="utf-8") as f:
+                for line in f:
+                    name, _, size = line.rstrip("\n").rpartition("\t")
+                    if name:
+                        sizes[name] = int(size)
+            cached = (mtime, sizes)
+            _sizesCache[fn] = cached
+        return cached[1].get(path.name)
+
+
 class Helper:
     def __str__(self):
         return self.toString()
@@ -73,32 +172,23 @@ class Helper:
         Mode defaults to "module", use "seach" if you're validating a query.
         """
 
-        if mode == "module":
-            xsd = pkgutil.get_data(__name__, "data/xsd/module_1_6.xsd")
-        elif mode == "search":
-            xsd = pkgutil.get_data(__name__, "data/xsd/search_1_8.xsd")
-        elif mode == "voc":
-            xsd = pkgutil.get_data(__name__, "data/xsd/vocabulary_1_1.xsd")
-        else:
-            raise TypeError("Unknown validation mode")
-        # more options for http access?
-
-        # if not hasattr(self, mode):
-        self.mode = etree.fromstring(xsd)
-        xmlschema = etree.XMLSchema(self.mode)
-        xmlschema.assertValid(self.etree)  # dies if doesn't validate
+        # schemas are compiled once and cached, see get_schema
+        get_schema(mode).assertValid(self.etree)  # dies if doesn't validate
         return True
 
-    def xpath(self, xpath: str) -> list:
+    def xpath(self, xpath: str, **variables) -> list:
         """
         Shortcut to access the data in a Module object using lxml's xpath;
         use m: for Zetcom's Module namespace.
 
         Note: This is the first method with a positional argument that I write
         in a long time.
+
+        New: Compiled expressions are cached, so prefer xpath variables to
+        f-strings, e.g. m.xpath("//m:module[@name = $mtype]", mtype="Object").
         """
 
-        return self.etree.xpath(xpath, namespaces=NSMAP)
+        return compile_xpath(xpath)(self.etree, **variables)
 
     def _write(self, *, path, doc) -> None:
         # ,pretty_print=True, method="c14n2"
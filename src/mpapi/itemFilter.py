@@ -0,0 +1,209 @@
+"""
+ItemFilter - removes moduleItems according to rules declared in toml
+
+USAGE
+    f = ItemFilter.fromFile("rules.toml")  # or ItemFilter.default()
+    f = ItemFilter(rules=[{"mtype": "Multimedia", "suffix": [".pdf"]}])
+    removed = f.filter(data=m)  # in place; returns no of removed items
+    f.filterFile(src="chunk1.zip", target="filter/chunk1.zip")  # streaming
+
+RULES
+    [[rule]]
+    label = "no pdfs"          # optional, used in the log
+    mtype = "Multimedia"       # required
+    suffix = [".pdf", ".mp3"]  # file name (MulOriginalFileTxt) ends with
+    field = "ObjTechnicalTermClb"  # field name, needs equals or notEquals
+    equals = ["a", "b"]        # a value of field is one of these
+    notEquals = ["c"]          # a value of field is none of these
+    owner = "..."              # verwaltende Institution (ObjOwnerRef) is one of
+    notOwner = "..."           # a verwaltende Institution is none of these
+
+A moduleItem is removed if it matches any rule; it matches a rule if all
+conditions of that rule are true. Values can be strings or lists of strings.
+Suffixes are case-sensitive. Like != in XPath, notEquals and notOwner match if
+any value differs, so an object with two owners, one of them listed, is still
+removed by notOwner; items without a value don't match.
+For field, we look at the value of data, system and virtual fields and at
+the (German) formattedValue of vocabulary and module references.
+
+All rules are checked in a single traversal of the document, so adding rules
+doesn't add passes. Afterwards moduleReferenceItems that point to removed
+items are dropped, too.
+"""
+
+import logging
+from lxml import etree  # type: ignore
+from mpapi.constants import NSMAP, XPATH, load_conf
+from mpapi.module import Module, ModuleWriter
+from pathlib import Path
+import pkgutil
+
+try:
+    import tomllib  # new in Python v3.11
+except ModuleNotFoundError:
+    import tomli as tomllib  # < Python v3.11
+
+ET = etree._Element
+
+_values = etree.XPath(
+    """m:*[@name = $name]/m:value/text()
+    | m:*[@name = $name]/m:*/m:formattedValue[@language = 'de']/text()""",
+    namespaces=NSMAP,
+)
+
+_allowed = {
+    "label",
+    "mtype",
+    "suffix",
+    "field",
+    "equals",
+    "notEquals",
+    "owner",
+    "notOwner",
+}
+
+
+class ItemFilter:
+    def __init__(self, *, rules: list[dict]) -> None:
+        """
+        EXPECTS
+        * rules: list of rules (dicts) as described in the module docstring
+
+        Rules are checked here, so that errors show before any data is touched.
+        """
+        self.rules: dict[str, list[dict]] = {}  # mtype: rules
+        for no, rule in enumerate(rules, start=1):
+            rule = dict(rule)
+            rule.setdefault("label", f"rule {no}")
+            unknown = set(rule) - _allowed
+            if unknown:
+                raise SyntaxError(f"Unknown key(s) in {rule['label']}: {unknown}")
+            if "mtype" not in rule:
+                raise SyntaxError(f"{rule['label']} has no mtype")
+            if "field" in rule and not {"equals", "notEquals"} & set(rule):
+                raise SyntaxError(f"{rule['label']}: field needs equals or notEquals")
+            for key in ("suffix", "equals", "notEquals", "owner", "notOwner"):
+                if isinstance(rule.get(key), str):
+                    rule[key] = [rule[key]]
+            if "suffix" in rule:
+                rule["suffix"] = tuple(rule["suffix"])
+            self.rules.setdefault(rule["mtype"], []).append(rule)
+        self.removed: set[tuple[str, str]] = set()  # (mtype, ID)
+
+    @classmethod
+    def fromFile(cls, path: Path | str) -> "ItemFilter":
+        """
+        Make a filter from the [[rule]] tables of a toml file.
+        """
+        return cls(rules=load_conf(Path(path)).get("rule", []))
+
+    @classmethod
+    def default(cls) -> "ItemFilter":
+        """
+        The rules the filter command uses (data/filter.toml).
+        """
+        toml = pkgutil.get_data(__name__, "data/filter.toml").decode()
+        return cls(rules=tomllib.loads(toml)["rule"])
+
+    def filter(self, *, data: Module) -> int:
+        """
+        Remove moduleItems matching a rule from data (in place) and the
+        moduleReferenceItems pointing to them. Items are removed with delItem,
+        so the item index stays valid and totalSize is updated when data is
+        written; moduleReference@size is updated, too.
+
+        RETURNS
+        * number of removed moduleItems
+        """
+        self.removed = set()
+        for itemN in list(data):
+            mtype = itemN.getparent().get("name")
+            if self.match(itemN=itemN, mtype=mtype):
+                data.delItem(mtype=mtype, modItemId=itemN.get("id"))
+        if self.removed:
+            self._dropDangling(data.etree)
+        return len(self.removed)
+
+    def filterFile(self, *, src: Path | str, target: Path | str) -> int:
+        """
+        Streaming version of filter: items are read one by one from src (xml
+        or zip) and the remaining ones are written to target (xml or zip, see
+        ModuleWriter). Neither document exists in memory as a whole.
+
+        src is read twice, but written only once: the rules are checked in
+        the first pass, the second pass writes the items and drops references
+        to removed items. A single pass can't do that without keeping the
+        document (or a copy of it) around, because references usually come
+        before the items they point to (Object before Multimedia). The first
+        pass only parses; items are discarded right away.
+
+        RETURNS
+        * number of removed moduleItems
+        """
+        self.removed = set()
+        for itemN in Module.iterfile(src):
+            self.match(itemN=itemN, mtype=itemN.getparent().get("name"))
+        with ModuleWriter(path=target) as writer:
+            for itemN in Module.iterfile(src):
+                mtype = itemN.getparent().get("name")
+                if (mtype, itemN.get("id")) in self.removed:
+                    continue
+                if self.removed:
+                    self._dropDangling(itemN)
+                writer.add(itemN=itemN, mtype=mtype)
+        return len(self.removed)
+
+    def match(self, *, itemN: ET, mtype: str) -> str | None:
+        """
+        Returns the label of the first rule a moduleItem matches or None.
+        Matching items are remembered (see removed) and logged.
+        """
+        for rule in self.rules.get(mtype, []):
+            if self._matchRule(itemN=itemN, rule=rule):
+                ID = itemN.get("id")
+                self.removed.add((mtype, ID))
+                logging.info(f"DEL {mtype} {ID} ({rule['label']})")
+                return rule["label"]
+        return None
+
+    #
+    # private
+    #
+
+    def _dangling(self, refItemN: ET) -> bool:
+        target = refItemN.getparent().get("targetModule")
+        return (target, refItemN.get("moduleItemId")) in self.removed
+
+    def _dropDangling(self, node: ET) -> None:
+        """
+        Drop moduleReferenceItems pointing to removed items below node and
+        correct the size of their moduleReferences.
+        """
+        refs = set()
+        for refItemN in XPATH["refItems"](node):
+            if self._dangling(refItemN):
+                refN = refItemN.getparent()
+                refN.remove(refItemN)
+                refs.add(refN)
+        for refN in refs:
+            if refN.get("size") is not None:
+                refN.set("size", str(int(XPATH["refItemCount"](refN))))
+
+    def _matchRule(self, *, itemN: ET, rule: dict) -> bool:
+        if "suffix" in rule:
+            dateinameL = XPATH["dateiname"](itemN)
+            if not dateinameL or not dateinameL[0].endswith(rule["suffix"]):
+                return False
+        if "field" in rule:
+            valueL = _values(itemN, name=rule["field"])
+            if "equals" in rule and not set(valueL) & set(rule["equals"]):
+                return False
+            if "notEquals" in rule and not set(valueL) - set(rule["notEquals"]):
+                return False
+        if "owner" in rule or "notOwner" in rule:
+            ownerL = _values(itemN, name="ObjOwnerRef")
+            if "owner" in rule and not set(ownerL) & set(rule["owner"]):
+                return False
+            if "notOwner" in rule and not set(ownerL) - set(rule["notOwner"]):
+                return False
+        return True
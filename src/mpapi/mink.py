@@ -21,15 +21,20 @@ COMMANDs (from jobs.toml)
     pack    : pack together several (clean) files
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import logging
 from mpapi.chunky import Chunky
-from mpapi.client import MpApi
+from mpapi.client import MpApi, TransportPolicy
 from mpapi.constants import load_conf
-from mpapi.module import Module
+from mpapi.module import Module, ModuleWriter
 from mpapi.sar import Sar
+import os
 from pathlib import Path
+import shutil
 import sys
+import tempfile
 from typing import Optional
 
 
@@ -61,9 +66,18 @@ class Mink:
         self.project_dir = self._mkdirs(job)
         self.parts_dir = self.project_dir / "parts"
         self._init_log(self.project_dir)
-        self.sar = Sar(baseURL=baseURL, user=user, pw=pw)
-        self.api = MpApi(baseURL=baseURL, user=user, pw=pw)
-        self.chunker = Chunky(chunkSize=chunkSize, baseURL=baseURL, pw=pw, user=user)
+        # one policy for all clients, so stats cover the whole run
+        self.policy = TransportPolicy.fromConf(self.job_data["http"])
+        self.sar = Sar(baseURL=baseURL, user=user, pw=pw, policy=self.policy)
+        self.api = MpApi(baseURL=baseURL, user=user, pw=pw, policy=self.policy)
+        self.chunker = Chunky(
+            chunkSize=chunkSize,
+            baseURL=baseURL,
+            pw=pw,
+            user=user,
+            policy=self.policy,
+            workers=self.job_data.get("workers", 1),
+        )
         logging.info(f"Project dir: {self.project_dir}")
 
         Type = self.job_data["type"]  # cannot be None
@@ -97,6 +111,7 @@ class Mink:
                 self.join(Type=Type, ID=ID, since=since, label=label)
             case "pack":  # untested
                 self.pack()
+        logging.info(f"http stats: {dict(self.policy.stats)}")
 
     def chunk(
         self,
@@ -122,24 +137,43 @@ class Mink:
         no, offset = self._fastforward(Type=Type, ID=ID, suffix=".zip")
         print(f" fast forwarded to chunk no {no} with offset {offset}")
 
-        for chunkM in self.chunker.getByType(
+        chunkL = self.chunker.getByType(
             ID=ID,
             Type=Type,
             target=target,
             since=since,
             offset=offset,
             onlyPublished=onlyPublished,
-        ):
-            if chunkM:  # Module is True if >0 items
-                # print(f"###chunk size:{chunkM.actualSize(module='Object')}")
+        )
+        pipeline = self.job_data.get("pipeline", 0)
+        if not pipeline:
+            for chunkM in chunkL:
+                if chunkM:  # Module is True if >0 items
+                    chunk_fn = self._chunkPath(Type=Type, ID=ID, no=no, suffix=".xml")
+                    self._writeChunk(data=chunkM, path=chunk_fn)
+                    no += 1
+                else:
+                    print("Chunk empty; we're at the end")
+            return
+
+        # pipelined: while chunks are cleaned, zipped and validated in a pool
+        # of {pipeline} threads, the next chunks are already being fetched.
+        # At most 2 * {pipeline} chunks wait to be processed (backpressure).
+        with ThreadPoolExecutor(max_workers=pipeline) as executor:
+            window = deque()
+            for chunkM in chunkL:
+                if not chunkM:
+                    print("Chunk empty; we're at the end")
+                    continue
                 chunk_fn = self._chunkPath(Type=Type, ID=ID, no=no, suffix=".xml")
-                chunkM.clean()
-                logging.info(f"zipping chunk {chunk_fn}")
-                chunkM.toZip(path=chunk_fn)
-                chunkM.validate()
+                window.append(
+                    executor.submit(self._writeChunk, data=chunkM, path=chunk_fn)
+                )
                 no += 1
-            else:
-                print("Chunk empty; we're at the end")
+                if len(window) >= 2 * pipeline:
+                    window.popleft().result()  # raises errors from worker
+            for future in window:
+                future.result()
 
     def getItem(self, module: str, ID: int) -> Module:
         """
@@ -156,7 +190,7 @@ class Mink:
         else:
             logging.info(f"getItem module={module} Id={ID} out_fn={out_fn}")
             r = self.api.getItem(module=module, id=ID)
-            m = Module(xml=r.text)
+            m = Module(xml=r.content)
             m.toFile(path=out_fn)
             return m
 
@@ -227,6 +261,13 @@ class Mink:
         Pack (or join) all clean files into one bigger package. We act on all
         *-join-*.xml files in the current project directory and save to
         $label$date.xml in current working directory.
+
+        NEW
+        * Streams items from the join files into the pack file instead of
+          adding Modules in memory, so packs can be larger than memory. Like
+          with Module.add, of items with the same id, only the newest survives.
+          A first pass determines which file has the surviving copy of each
+          item, a second pass writes items mtype by mtype.
         """
         label = str(self.project_dir.parent.name)
         date = str(self.project_dir.name)
@@ -235,16 +276,50 @@ class Mink:
             print(f"Pack file exists already, no overwrite: {pack_fn}")
         else:
             print(f"Making new pack file: {pack_fn}")
-            m = Module()
-            for in_fn in self.project_dir.glob("*-join-*.xml"):
-                print(f"Packing file {in_fn}")
-                m = m + Module(file=in_fn)
-            m.toFile(path=pack_fn)
+            joinL = sorted(self.project_dir.glob("*-join-*.xml"))
+            newest: dict[tuple[str, str], tuple[str, int]] = {}
+            for no, in_fn in enumerate(joinL):
+                print(f"Scanning file {in_fn}")
+                for itemN in Module.iterfile(in_fn):
+                    key = (itemN.getparent().get("name"), itemN.get("id"))
+                    lastModified = Module._standardDT(inputN=itemN)
+                    if key not in newest or newest[key][0] < lastModified:
+                        newest[key] = (lastModified, no)
+
+            mtypes = list(dict.fromkeys(mtype for mtype, ID in newest))
+            with ModuleWriter(path=pack_fn) as w:
+                for mtype in mtypes:
+                    for no, in_fn in enumerate(joinL):
+                        print(f"Packing {mtype} from file {in_fn}")
+                        for itemN in Module.iterfile(in_fn, mtype=mtype):
+                            key = (mtype, itemN.get("id"))
+                            if key in newest and newest[key][1] == no:
+                                w.add(itemN=itemN, mtype=mtype)
+                                del newest[key]  # write every item only once
 
     #
     # HELPERS
     #
 
+    def _writeChunk(self, *, data: Module, path: Path) -> None:
+        """
+        Clean, validate and zip a chunk. The zip file is written to a temp
+        dir of its own first and moved into place when complete, so that
+        _fastforward never sees half-written chunks, even if chunks are
+        written in parallel. The temp dir is removed in any case.
+        """
+        data.clean()
+        data.validate()
+        zip_fn = path.with_suffix(".zip")
+        logging.info(f"zipping chunk {path}")
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.project_dir))
+        try:
+            with ModuleWriter(path=tmp_dir / zip_fn.name) as w:
+                w.addModule(data=data)
+            os.replace(tmp_dir / zip_fn.name, zip_fn)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
     def _chunkPath(self, *, Type, ID, no, suffix):
         return self.project_dir / f"{Type}{ID}-chunk{no}{suffix}"
 
@@ -358,6 +433,10 @@ class Mink:
                 job_data[key]
             except KeyError:
                 raise SyntaxError("job '{job}' missing config value '{key}'")
+
+        # optional transport policy: [http] table for all jobs, overwritten
+        # by the job's own http values
+        job_data["http"] = conf_data.get("http", {}) | job_data.get("http", {})
         return job_data
 
 
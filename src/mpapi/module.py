@@ -56,12 +56,17 @@ USAGE:
     for item in m.iter(module="Object"):
         #do something with object item
 
+    # stream items from huge files (xml or zip) without loading them
+    for item in Module.iterfile("pack.xml", mtype="Object"):
+        #do something with object item
+
     # deleting stuff
     m.dropRepeatableGroup(parent=miN, name="ObjValuationGrp")
     m._dropFields(parent=miN, type="systemField")
     m._dropFieldsByName(element="repeatableGroup", name="ObjValuationGrp")
     m._dropAttribs(xpath="//m:dataField", attrib="uuid")
     m.clean()  # drops uuid attributes and certain value elements
+    (CLEAN + UPLOAD_FORM).apply(itemN)  # same rules for single items
 
     # other changes to xml
     m.updateTotalSize() # update for all module types
@@ -76,16 +81,25 @@ USAGE:
     rgN = m.repeatableGroup(parent=miN, name=name, size=size)
     rgiN = m.repeatableGroupItem(parent=rgN, id=id)
     m.dataField(parent=rgiN, dataType="Clob", name="ObjTechnicalTermClb", value="Zupfinstrument")
+
+    # WRITING HUGE DOCUMENTS INCREMENTALLY
+    with ModuleWriter(path="pack.zip") as w:  # or pack.xml
+        for item in Module.iterfile("chunk1.xml"):
+            w.add(itemN=item)
 """
 
 from collections import namedtuple  # experimenting with namedtuples
 from copy import deepcopy  # for lxml
+import shutil
+import tempfile
 from lxml import etree  # type: ignore
 from lxml.etree import XMLSyntaxError
-from mpapi.constants import NSMAP, parser
-from mpapi.helper import Helper
+from mpapi.constants import NSMAP, XPATH, parser
+from mpapi.helper import Helper, compile_xpath, validate_item
 from pathlib import Path
-from typing import Any, Iterator, Optional, Self
+from typing import Any, Iterable, Iterator, Optional, Self
+from xml.sax.saxutils import quoteattr
+from zipfile import ZipFile, ZIP_LZMA
 
 
 # xpath 1.0 and lxml don't allow empty string or None for default ns
@@ -96,6 +110,128 @@ ET = Any
 Item = namedtuple("Item", ["type", "id"])
 
 
+class Transform:
+    """
+    A set of drop rules that is applied in a single pass over a document or
+    a single moduleItem, e.g. while streaming.
+
+    USAGE
+        t = Transform(
+            drop={"virtualField"},                       # element names
+            dropByName={"dataField": {"ModifiedByTxt"}}, # elements with @name
+            dropAttribs={"dataField": {"dataType"}, "*": {"uuid"}},
+        )
+        t.apply(itemN)
+        t2 = t + other  # rules of both
+
+    Element names are local names in the module namespace; "*" in
+    dropAttribs applies to all elements. See CLEAN and UPLOAD_FORM.
+    """
+
+    def __init__(
+        self,
+        *,
+        drop: Iterable[str] = (),
+        dropByName: dict[str, Iterable[str]] | None = None,
+        dropAttribs: dict[str, Iterable[str]] | None = None,
+    ) -> None:
+        ns = "{http://www.zetcom.com/ria/ws/module}"
+        self.drop = {f"{ns}{tag}" for tag in drop}
+        self.dropByName = {
+            f"{ns}{tag}": set(names) for tag, names in (dropByName or {}).items()
+        }
+        self.dropAttribs = {
+            tag if tag == "*" else f"{ns}{tag}": set(attribs)
+            for tag, attribs in (dropAttribs or {}).items()
+        }
+        self._prepare()
+
+    def __add__(self, other: "Transform") -> "Transform":
+        new = Transform()
+        new.drop = self.drop | other.drop
+        for attr in ("dropByName", "dropAttribs"):
+            merged = {k: set(v) for k, v in getattr(self, attr).items()}
+            for k, v in getattr(other, attr).items():
+                merged.setdefault(k, set()).update(v)
+            setattr(new, attr, merged)
+        new._prepare()
+        return new
+
+    def apply(self, node: ET) -> None:
+        """
+        Apply all rules to node (document, moduleItem or any element) and its
+        descendants. Changes node in place.
+        """
+        if not (self.drop or self.dropByName or self.dropAttribs):
+            return
+        if hasattr(node, "getroot"):
+            node = node.getroot()
+        removeL = []
+        for elemN in node.iter(*self._tags):
+            tag = elemN.tag
+            if tag in self.drop or elemN.get("name") in self.dropByName.get(tag, ()):
+                removeL.append(elemN)
+                continue
+            for attrib in self.dropAttribs.get(tag, ()):
+                elemN.attrib.pop(attrib, None)
+            for attrib in self._allAttribs:
+                elemN.attrib.pop(attrib, None)
+        for elemN in removeL:
+            parentN = elemN.getparent()
+            if parentN is not None:
+                parentN.remove(elemN)
+
+    def _prepare(self) -> None:
+        self._allAttribs = self.dropAttribs.get("*", set())
+        # without rules for all elements, libxml2 only hands us the elements
+        # we have rules for
+        if self._allAttribs:
+            self._tags = ()
+        else:
+            self._tags = tuple(self.drop | set(self.dropByName) | set(self.dropAttribs))
+
+
+# drops uuid attributes b/c they sometimes don't validate (Zetcom bug) and
+# Werte und Versicherung to not spill our guts
+CLEAN = Transform(
+    dropByName={"repeatableGroup": {"ObjValuationGrp"}},
+    dropAttribs={"*": {"uuid"}},
+)
+
+# download form -> upload form; we want to preserve systemField:__orgUnit
+UPLOAD_FORM = Transform(
+    drop={"virtualField", "formattedValue"},
+    dropByName={
+        "systemField": {
+            "__id",
+            "__lastModified",
+            "__lastModifiedUser",
+            "__createdUser",
+            "__created",
+        },
+        "dataField": {
+            "ModifiedByTxt",
+            "ModifiedDateDat",
+            "ObjRecordCreatedByTxt",
+            "ObjInventoryDateDat",
+            "DatestampFromFuzzySearchLnu",
+            "DatestampToFuzzySearchLnu",
+        },
+        "moduleReference": {"ObjMultimediaRef"},
+    },
+    dropAttribs={
+        # upload sometimes wants moduleItem@id, sometimes not
+        "repeatableGroup": {"size"},
+        "moduleItem": {"uuid", "hasAttachments"},
+        "moduleReferenceItem": {"uuid"},
+        "vocabularyReference": {"id", "instanceName"},
+        "vocabularyReferenceItem": {"name"},
+        "module": {"totalSize"},
+        "dataField": {"dataType"},
+    },
+)
+
+
 class Module(Helper):
     def __add__(self, m2: Self) -> Self:  # pytest complains when I add type hints
         """
@@ -122,27 +258,37 @@ class Module(Helper):
 
         RETURNS
         * lxml.etree._Element object
-        """
-        mtype = item[0]
-        ID = str(item[1])
 
-        itemN: ET = self.xpath(
-            f"/m:application/m:modules/m:module[@name = '{mtype}']/m:moduleItem[@id = '{ID}']"
-        )[0]
+        Raises IndexError if there is no such item. Uses the item index, so
+        lookups take constant time.
+        """
+        itemN = self._lookup(mtype=item[0], ID=item[1])
+        if itemN is None:
+            raise IndexError(f"No moduleItem {item[0]} {item[1]}")
         return itemN
 
     def __init__(
-        self, *, file: Path | str | None = None, tree: ET = None, xml: str | None = None
+        self,
+        *,
+        file: Path | str | None = None,
+        tree: ET = None,
+        xml: str | bytes | None = None,
     ) -> None:
         """
         There are FOUR ways to make a new Module object. Pick one:
             m = Module(file="path.xml") # from a file
             m = Module(tree=ET)         # from a lxml etree
-            m = Module(xml=xml)         # from string
+            m = Module(xml=xml)         # from string or bytes
             m = Module()                # from scratch
 
         INTERNALS
         * the lxml document is stored in self.etree
+        * xml can be bytes, e.g. r.content of a requests response; that saves
+          decoding the response and encoding it again for lxml
+        * an index {(mtype, id): moduleItem} is built lazily on first lookup
+          and kept up to date by Module's own methods. Setting self.etree
+          resets it. If you add moduleItems to the tree directly with lxml,
+          call m.reindex() afterwards.
 
         NEW
         * previous versions were not able to deal with multi-type documents;
@@ -166,18 +312,26 @@ class Module(Helper):
             </application>"""
             self.etree = etree.fromstring(xml, parser)
 
-    def _from_xml(self, xml: str):
-        # fromstring is for xml without encoding declaration
-        if isinstance(xml, bytes):
-            try:
-                ET = etree.fromstring(xml, parser)
-            except XMLSyntaxError:
-                raise SyntaxError("Invalid module XML--!")
-        else:
-            try:
-                ET = etree.fromstring(bytes(xml, "utf-8"), parser)
-            except XMLSyntaxError:
-                raise SyntaxError("Invalid module XML!")
+    @property
+    def etree(self) -> ET:
+        return self._etree
+
+    @etree.setter
+    def etree(self, tree: ET) -> None:
+        self._etree = tree
+        self._index: dict[tuple[str, str], ET] | None = None
+        # True if items were added since totalSize was last updated
+        self._dirty = False
+
+    def _from_xml(self, xml: str | bytes):
+        # bytes go to lxml directly; strings are encoded first, since
+        # fromstring doesn't accept str with an encoding declaration
+        if isinstance(xml, str):
+            xml = xml.encode("utf-8")
+        try:
+            ET = etree.fromstring(xml, parser)
+        except XMLSyntaxError:
+            raise SyntaxError("Invalid module XML!")
         return ET
 
     def __iter__(self) -> ET:
@@ -188,8 +342,7 @@ class Module(Helper):
             for moduleItem in m:
                 #do something with moduleItem
         """
-        apath = "/m:application/m:modules/m:module/m:moduleItem"
-        itemsN = self.xpath(apath)
+        itemsN = XPATH["items"](self.etree)
         for itemN in itemsN:
             yield itemN
 
@@ -208,7 +361,7 @@ class Module(Helper):
         to check type:
             isinstance(m, Module)
         """
-        return int(self.xpath("count(/m:application/m:modules/m:module/m:moduleItem)"))
+        return int(XPATH["itemCount"](self.etree))
 
     def actualSize(self, *, module: str) -> int:
         """
@@ -234,11 +387,7 @@ class Module(Helper):
               <module name="Object" totalSize="173">
         """
         try:
-            return int(
-                self.xpath(
-                    f"count(/m:application/m:modules/m:module[@name ='{module}']/m:moduleItem)"
-                )
-            )
+            return int(XPATH["itemCountByType"](self.etree, mtype=module))
         except Exception:
             raise TypeError(
                 f"Requested module '{module}' doesn't exist or has no moduleItems"
@@ -260,55 +409,47 @@ class Module(Helper):
         * Loop through the module types of the new document. For every type
         check if that type already exists in the old document and make it if
         necessary.
-        * For every moduleItem in newdoc check if it already exists in the old
-        and make or replace it if necessary.
+        * For every moduleItem in newdoc look up its id in an index of the old
+        doc (built once per mtype) and add it or replace the old item if the
+        new one has a newer __lastModified.
 
         That means we dont need to know what the types in the old doc are.
 
-        m.join(doc=lxml)
-        m.join(doc=Module())
+        m.add(doc=lxml)
+        m.add(doc=Module().toET())
 
-        Should doc be an lxml object or another Module?
         NEW
         * At some point, the method add would change doc so that after
           completion, doc was practically empty.
-        * The current implmentation is very slow; it takes ca. 20 min to add a
-          couple thousand records.
+        * The old implementation ran one absolute xpath per new item and took
+          ca. 20 min to add a couple thousand records. Now we use a dict
+          {id: moduleItem} per mtype, so adding is linear in the number of
+          items. doc is no longer deep-copied as a whole; only the items that
+          end up in self are copied.
+        * Older items are now actually replaced by newer ones.
         """
-        doc2 = deepcopy(doc)  # leave doc alone, so we don't change it
-        d2moduleL = doc2.xpath(  # newdoc
-            "/m:application/m:modules/m:module",
-            namespaces=NSMAP,
-        )
+        d2moduleL: list[ET] = XPATH["moduleL"](doc)  # newdoc
 
         for d2moduleN in d2moduleL:
-            try:
-                d2mtypeL: list[ET] = d2moduleN.xpath(
-                    "/m:application/m:modules/m:module/@name", namespaces=NSMAP
-                )
-            except Exception:
-                # newdoc has no mtypes, so appears empty, nothing to add
-                # print("newdoc appears to be empty")
-                return None
-
-            for d2mtype in d2mtypeL:
-                # print(f"newdoc mtype: {d2mtype}")
-                try:  # Does this mtype exist in old doc?
-                    self.xpath(
-                        f"/m:application/m:modules/m:module[@name = '{d2mtype}']"
-                    )[0]
-                except Exception:
-                    # old doc doesn't have this mtype, so we add the whole
-                    # all of d2's modules[@name = {mtype}]/moduleItems to d1
-                    # print (f"d1 doesn't know this mtype {d2mtype}")
-                    d1modules = self.xpath("/m:application/m:modules")[0]
-                    d1modules.append(d2moduleN)
-                else:
-                    # new doc's mtype exists already in old doc
-                    # we need to compare each item in d1 and d2
-                    # print("b4 _compareItems")
-                    self._compareItems(mtype=d2mtype, moduleN=d2moduleN)
-        self.updateTotalSize()
+            d2mtype = d2moduleN.get("name")
+            try:  # Does this mtype exist in old doc?
+                XPATH["module"](self.etree, mtype=d2mtype)[0]
+            except IndexError:
+                # old doc doesn't have this mtype, so we add the whole
+                # module[@name = {mtype}] with its moduleItems to d1
+                d1modulesN = XPATH["modules"](self.etree)[0]
+                moduleN = deepcopy(d2moduleN)
+                d1modulesN.append(moduleN)
+                if self._index is not None:
+                    for itemN in moduleN.iterchildren(
+                        "{http://www.zetcom.com/ria/ws/module}moduleItem"
+                    ):
+                        self._index[(d2mtype, itemN.get("id"))] = itemN
+            else:
+                # new doc's mtype exists already in old doc
+                # we need to compare each item in d1 and d2
+                self._compareItems(mtype=d2mtype, moduleN=d2moduleN)
+        self._dirty = True
 
     def addItem(self, *, itemN: ET, mtype: str):
         """
@@ -318,6 +459,10 @@ class Module(Helper):
         - We're now checking if item (with that modItemId) exists already. If so, we're
           discarding the old item before adding the new one.
         - We're working on a deepcopy; otherwise we have xml chaos
+        - Existence check uses the item index, i.e. takes constant time
+        - totalSize is no longer updated for every item, but only once when
+          the document is written or totalSize is requested, so adding n items
+          is linear
         """
 
         newN = deepcopy(itemN)  # dont touch the original
@@ -328,7 +473,9 @@ class Module(Helper):
         # it's conceivable that internal module has no module[@name=mtype] yet
         moduleN = self.module(name=mtype)
         moduleN.append(newN)
-        self.updateTotalSize()
+        if self._index is not None and modItemId is not None:
+            self._index[(mtype, modItemId)] = newN
+        self._dirty = True
 
     def clean(self) -> None:
         """
@@ -337,9 +484,10 @@ class Module(Helper):
         * drops Werte und Versicherung to not spill our guts
         * this method doesn't do any validation
         SEE ALSO sanitize
+
+        NEW: single pass over the document, rules in CLEAN
         """
-        self.dropUUID()
-        self.dropRepeatableGroup(name="ObjValuationGrp")
+        CLEAN.apply(self.etree)
 
     def dataField(
         self,
@@ -368,9 +516,7 @@ class Module(Helper):
         </dataField>
         """
         try:
-            dataFieldN = parent.xpath(
-                f"m:/dataField[@name='{name}']", namespaces=NSMAP
-            )[0]
+            dataFieldN = XPATH["dataField"](parent, name=name)[0]
         except Exception:
             if dataType is None:
                 # print (f"{name=}")
@@ -410,15 +556,14 @@ class Module(Helper):
         return systemFieldN
 
     def delItem(self, *, modItemId: int, mtype: str):
-        itemN = self.xpath(
-            """/m:application/m:modules/m:module[
-            @name = '{mtype}'
-        ]/m:moduleItem[
-            @id = '{str(modItemId)}'
-        ]"""
-        )[0]
-
+        """
+        Remove the moduleItem with that id from the document. Raises IndexError
+        if there is no such item. Like addItem, marks totalSize for update.
+        """
+        itemN = self[(mtype, modItemId)]
         itemN.getparent().remove(itemN)
+        del self._index[(mtype, str(modItemId))]
+        self._dirty = True
 
     def describe(self) -> dict:
         """
@@ -430,25 +575,16 @@ class Module(Helper):
         """
         # report[type] = number_of_items
 
-        known_types = set()
         report = dict()
-        moduleL: list[ET] = self.xpath("/m:application/m:modules/m:module")
-        for moduleN in moduleL:
-            moduleA = moduleN.attrib
-            known_types.add(moduleA["name"])
-
-        for Type in known_types:
-            itemL: list[ET] = self.xpath(
-                f"/m:application/m:modules/m:module[@name = '{Type}']/m:moduleItem"
-            )
-            report[Type] = len(itemL)
+        for Type in self._types():
+            report[Type] = int(XPATH["itemCountByType"](self.etree, mtype=Type))
         return report
 
     def dropUUID(self) -> None:
         """
         Drop all @uuid attributes from the whole document.
         """
-        itemL = self.xpath("//m:*[@uuid]")
+        itemL = XPATH["uuid"](self.etree)
 
         for eachN in itemL:
             eachN.attrib.pop("uuid", None)  # Why None here?
@@ -457,12 +593,12 @@ class Module(Helper):
         """
         Drop a repeatableGroup by name. Expects the rGrp's name.
         """
-        rgL = self.xpath(f"//m:repeatableGroup[@name ='{name}']")
+        rgL = XPATH["repeatableGroupsByName"](self.etree, name=name)
         for rgN in rgL:
             rgN.getparent().remove(rgN)
 
     def extract_first_id(self) -> int:
-        return self.xpath("/m:application/m:modules/m:module/m:moduleItem[1]/@id")[0]
+        return XPATH["firstId"](self.etree)[0]
 
     def extract_mtype(self) -> str:
         """
@@ -471,7 +607,7 @@ class Module(Helper):
         Raises ValueError if zero or more than 1 mtypes in data
         """
 
-        mtypeL = self.xpath("/m:application/m:modules/m:module/@name")
+        mtypeL = XPATH["mtypes"](self.etree)
         if len(mtypeL) == 0:
             raise ValueError("Data has no content")
         if len(mtypeL) > 1:
@@ -484,17 +620,20 @@ class Module(Helper):
         Returns list of mtypes
 
         """
-        return self.xpath("/m:application/m:modules/m:module/@name")
+        return XPATH["mtypes"](self.etree)
 
     def get_ids(self, *, mtype: str) -> list[int]:
         """
         Return the IDs of all records of one mtype (such as "Person") as a list.
         """
-        idL = self.xpath(
-            f"/m:application/m:modules/m:module[@name='{mtype}']/m:moduleItem/@id"
-        )
-        # idL contains ids as str, we want int. Do we really [int(ID) for ID in idL]
-        return [int(ID) for ID in idL]
+        moduleL = XPATH["module"](self.etree, mtype=mtype)
+        return [
+            int(itemN.get("id"))
+            for moduleN in moduleL
+            for itemN in moduleN.iterchildren(
+                "{http://www.zetcom.com/ria/ws/module}moduleItem"
+            )
+        ]
 
     def item_exists(self, *, mtype: str, ID: int) -> bool:
         """
@@ -503,14 +642,9 @@ class Module(Helper):
                 do_something()
             else:
                 or_another()
-        Used to be called existsItem.
+        Used to be called existsItem. Takes constant time (see item index).
         """
-        try:
-            self[(mtype, ID)]
-        except IndexError:
-            return False
-        else:
-            return True
+        return self._lookup(mtype=mtype, ID=ID) is not None
 
     def iter(self, *, module: str = "Object") -> Iterator:
         """
@@ -530,11 +664,45 @@ class Module(Helper):
         INTERFACE
         * Does it make sense to return records(=moduleItems)?
         """
-        apath = f"/m:application/m:modules/m:module[@name ='{module}']/m:moduleItem"
-        itemsN = self.xpath(apath)
+        itemsN = XPATH["itemsByType"](self.etree, mtype=module)
         for itemN in itemsN:
             yield itemN
 
+    @staticmethod
+    def iterfile(path: Path | str, mtype: str | None = None) -> Iterator[ET]:
+        """
+        Streams moduleItems from a file without loading the whole document, so
+        memory stays constant even for huge chunk or pack files.
+
+        USAGE
+            for itemN in Module.iterfile("pack.xml", mtype="Object"):
+                #do something with itemN
+
+        EXPECTS
+        * path: xml file or zip file as written by toZip (with a single member)
+        * mtype (optional): only yield moduleItems of this module type
+
+        RETURNS
+        * iterator of moduleItem elements
+
+        CAVEATS
+        * Every moduleItem is cleared and removed from its document once the
+          next one is requested, so deepcopy it if you want to keep it.
+        * While you hold an item, itemN.getparent().get("name") is its mtype.
+        """
+        path = Path(path)
+        if path.suffix.lower() == ".zip":
+            with ZipFile(path, "r") as zip:
+                memberL = zip.namelist()
+                if len(memberL) != 1:
+                    raise ValueError(
+                        f"ERROR: Zip file has not exactly one member {path}"
+                    )
+                with zip.open(memberL[0]) as f:
+                    yield from Module._iterparse(source=f, mtype=mtype)
+        else:
+            yield from Module._iterparse(source=str(path), mtype=mtype)
+
     def filter(self, *, xpath: str, mtype: str = "Object") -> Self:
         """
         For an xpath that returns a list of moduleItems, return a new Module object with
@@ -551,12 +719,11 @@ class Module(Helper):
             parser=parser,
         )
 
-        moduleN: Any = newET.xpath(
-            "/m:application/m:modules/m:module", namespaces=NSMAP
-        )[0]
+        moduleN: Any = XPATH["moduleL"](newET)[0]
         moduleItemL = self.xpath(xpath)
         print(f"FOUND ITEMS: {len(moduleItemL)}")
         [moduleN.append(moduleItemN) for moduleItemN in moduleItemL]
+        self._index = None  # items have moved to the new document
         m = Module(tree=newET)
         m.updateTotalSize()
         return m
@@ -591,12 +758,10 @@ class Module(Helper):
               ...
         """
         try:
-            moduleN = self.xpath(f"/m:application/m:modules/m:module[@name='{name}']")[
-                0
-            ]
+            moduleN = XPATH["module"](self.etree, mtype=name)[0]
         except Exception:
             # modules should always exist, module doesn't
-            modulesN = self.xpath("/m:application/m:modules")[0]
+            modulesN = XPATH["modules"](self.etree)[0]
             moduleN = etree.SubElement(
                 modulesN,
                 "{http://www.zetcom.com/ria/ws/module}module",
@@ -626,12 +791,11 @@ class Module(Helper):
             </systemField>
         </moduleItem>
         """
-        try:
-            item = parent.xpath(
-                f"/m:moduleItem[@id = '{ID}'",
-                namespaces=NSMAP,
-            )[0]
-        except Exception:
+        mtype = parent.get("name")
+        item = None
+        if ID is not None:
+            item = self._lookup(mtype=mtype, ID=ID)
+        if item is None:
             item = etree.Element(
                 "{http://www.zetcom.com/ria/ws/module}moduleItem",
             )
@@ -640,6 +804,8 @@ class Module(Helper):
             if hasAttachments is not None:
                 item.set("hasAttachments", hasAttachments.lower())
             parent.append(item)
+            if self._index is not None and ID is not None:
+                self._index[(mtype, str(ID))] = item
         return item
 
     def moduleReference(
@@ -669,10 +835,7 @@ class Module(Helper):
         </moduleReference>
         """
         try:
-            modRefN = parent.xpath(
-                f"./m:moduleReference[@name = '{name}']",
-                namespaces=NSMAP,
-            )[0]
+            modRefN = XPATH["moduleReference"](parent, name=name)[0]
         except Exception:
             modRefN = etree.SubElement(
                 parent,
@@ -700,6 +863,15 @@ class Module(Helper):
         )
         return mri
 
+    def reindex(self) -> None:
+        """
+        Rebuild the item index {(mtype, id): moduleItem}. Only necessary if you
+        changed the document behind Module's back, e.g. by appending moduleItems
+        with lxml directly.
+        """
+        self._index = None
+        self._itemIndex()
+
     def repeatableGroup(self, *, parent: ET, name: str, size: int | None = None):
         """
         Get existing repeatableGroup with that name or creates a new one.
@@ -719,10 +891,7 @@ class Module(Helper):
               <value>I C 7723</value>
         """
         try:
-            rGrp = parent.xpath(
-                f"./m:repeatableGroup[@name = '{name}']",
-                namespaces=NSMAP,
-            )[0]
+            rGrp = XPATH["repeatableGroup"](parent, name=name)[0]
         except Exception:
             rGrp = etree.SubElement(
                 parent,
@@ -779,7 +948,7 @@ class Module(Helper):
             "{http://www.zetcom.com/ria/ws/module}thumbnails",
         ]
 
-        for moduleItem in self.etree.xpath(".//m:moduleItem", namespaces=NSMAP):
+        for moduleItem in XPATH["items"](self.etree):
             children = list(moduleItem)
             # print(children)
             # Sort children by desired order; unknown tags go to the end
@@ -822,12 +991,9 @@ class Module(Helper):
            <modules>
               <module name="Object" totalSize="173">
         """
+        self._syncTotalSize()
         try:
-            return int(
-                self.xpath(
-                    f"/m:application/m:modules/m:module[@name ='{module}']/@totalSize"
-                )[0]
-            )
+            return int(XPATH["totalSize"](self.etree, mtype=module)[0])
         except Exception:
             raise TypeError(
                 f"Requested module '{module}' or attribute totalSize doesn't exist"
@@ -849,19 +1015,29 @@ class Module(Helper):
 
         for modType in knownTypes:
             # items per modType
-            itemsL = self.xpath(
-                f"/m:application/m:modules/m:module[@name = '{modType}']/m:moduleItem"
-            )
+            itemsN = int(XPATH["itemCountByType"](self.etree, mtype=modType))
             try:
-                moduleN = self.xpath(
-                    f"/m:application/m:modules/m:module[@name = '{modType}']"
-                )[0]
+                moduleN = XPATH["module"](self.etree, mtype=modType)[0]
             except Exception:
                 pass  # it's not an error if file has no items that can be counted
             else:
                 # print (f".............updating totalSize for {modType}")
                 attributes = moduleN.attrib
-                attributes["totalSize"] = str(int(len(itemsL)))
+                attributes["totalSize"] = str(itemsN)
+        self._dirty = False
+
+    def toFile(self, *, path: Path | str) -> None:
+        self._syncTotalSize()
+        super().toFile(path=path)
+
+    def toString(self, *, et: ET = None) -> str:
+        if et is None:
+            self._syncTotalSize()
+        return super().toString(et=et)
+
+    def toZip(self, *, path: Path) -> Path:
+        self._syncTotalSize()
+        return super().toZip(path=path)
 
     def uploadForm(self) -> None:
         """
@@ -874,60 +1050,14 @@ class Module(Helper):
 
         Transformations
         - drop all virtualFields, systemFields, formattedValue
+        - for details see UPLOAD_FORM, which is applied in a single pass over
+          the document and can also be applied to single moduleItems
 
         QUESTIONS:
         - Returns a copy or rewrites itself? Act as clean, so rewrite itself
         """
-
-        # we want to preserve systemField:__orgUnit
-        # self._dropFields(element="systemField")
-        self._dropFieldsByName(element="systemField", name="__id")
-        self._dropFieldsByName(element="systemField", name="__lastModified")
-        self._dropFieldsByName(element="systemField", name="__lastModifiedUser")
-        self._dropFieldsByName(element="systemField", name="__createdUser")
-        self._dropFieldsByName(element="systemField", name="__created")
-        # self._dropFieldsByName(element="systemField", name="__uuid")
-
-        self._dropFields(element="virtualField")
-        self._dropFields(element="formattedValue")
-
-        # upload sometimes wants id, sometimes not
-        # self._dropAttribs(xpath="//m:moduleItem", attrib="id")
-        # do we need to eliminate size attributes in repeatableGroups?
-        self._dropAttribs(xpath="//m:repeatableGroup", attrib="size")
-        self._dropAttribs(xpath="//m:moduleItem", attrib="uuid")
-
-        # various attributes in moduleReference? name we need to keep
-        # <moduleReference name="InvNumberSchemeRef" targetModule="InventoryNumber" multiplicity="N:1" size="1">
-        # self._dropAttribs(xpath="//m:moduleReference", attrib="targetModule")
-        # self._dropAttribs(xpath="//m:moduleReference", attrib="multiplicity")
-        # self._dropAttribs(xpath="//m:moduleReference", attrib="size")
-        self._dropAttribs(xpath="//m:moduleReferenceItem", attrib="uuid")
-        self._dropAttribs(xpath="//m:vocabularyReference", attrib="id")
-        self._dropAttribs(xpath="//m:vocabularyReference", attrib="instanceName")
-        self._dropAttribs(xpath="//m:vocabularyReferenceItem", attrib="name")
-        self._dropAttribs(xpath="//m:module", attrib="totalSize")
-        self._dropAttribs(xpath="//m:moduleItem", attrib="hasAttachments")
-        self._dropAttribs(xpath="//m:dataField", attrib="dataType")
-        # sometimes we want to have the rGrpItem@id
-        # self._dropAttribs(xpath="//m:repeatableGroupItem", attrib="id")
-        # self._dropAttribs(xpath="//m:moduleReferenceItem", attrib="seqNo")
-        # self._dropAttribs(xpath="//m:compositeItem", attrib="seqNo")
-        # modifiedBy, modifiedDate
-        #    <dataField dataType="Varchar" name="ModifiedByTxt">
-        #      <value>EM_EM</value>
-        #    </dataField>
-        #    <dataField dataType="Date" name="ModifiedDateDat">
-        #      <value>2010-05-07</value>
-        #    </dataField>
-        self._dropFieldsByName(element="dataField", name="ModifiedByTxt")
-        self._dropFieldsByName(element="dataField", name="ModifiedDateDat")
-        self._dropFieldsByName(element="dataField", name="ObjRecordCreatedByTxt")
-        self._dropFieldsByName(element="dataField", name="ObjInventoryDateDat")
-        self._dropFieldsByName(element="dataField", name="DatestampFromFuzzySearchLnu")
-        self._dropFieldsByName(element="dataField", name="DatestampToFuzzySearchLnu")
-        # self._dropFieldsByName(element="moduleReference", name="ObjObjectGroupsRef")
-        self._dropFieldsByName(element="moduleReference", name="ObjMultimediaRef")
+        UPLOAD_FORM.apply(self.etree)
+        self._dirty = False  # totalSize has been dropped, don't write it back
 
     def vocabularyReference(
         self,
@@ -960,9 +1090,7 @@ class Module(Helper):
         </vocabularyReference>
         """
         try:
-            vr = parent.xpath(
-                f"m:vocabularyReference[@name = '{name}']", namespaces=NSMAP
-            )[0]
+            vr = XPATH["vocabularyReference"](parent, name=name)[0]
         except Exception:
             # print (f"vr with name {name} doesn't exist yet")
             vr = etree.SubElement(
@@ -1008,9 +1136,7 @@ class Module(Helper):
         </vocabularyReferenceItem>
         """
         try:
-            vri = parent.xpath(
-                f"m:vocabularyReferenceItem[@name = '{name}']", namespaces=NSMAP
-            )[0]
+            vri = XPATH["vocabularyReferenceItem"](parent, name=name)[0]
         except Exception:
             vri = etree.SubElement(
                 parent,
@@ -1022,42 +1148,44 @@ class Module(Helper):
                 vri.set("id", str(ID))
         return vri
 
-    def xpath(self, path: str) -> ET:
-        return self.etree.xpath(path, namespaces=NSMAP)
+    def xpath(self, path: str, **variables) -> ET:
+        return compile_xpath(path)(self.etree, **variables)
 
     #
     # HELPER
     #
 
     def _compareItems(self, *, mtype: str, moduleN: ET):
-        # new doc's mtype exists already in old doc
-        # now compare each moduleItem in new doc
-        newItemsL: list[ET] = moduleN.xpath("./m:moduleItem", namespaces=NSMAP)
-        for newItemN in newItemsL:
-            newID = int(newItemN.attrib["id"])
-            try:
-                # item with that ID exists already
-                oldItemN = self.xpath(
-                    f"/m:application/m:modules/m:module[@name = '{mtype}']/m:moduleItem[@id = '{newID}']"
-                )[0]  # IDs should be unique
-            except Exception:
+        """
+        Merge the moduleItems of moduleN (from another document) into the
+        existing module[@name = {mtype}] of self.
+
+        We use the item index {(mtype, id): moduleItem}, so every new item is
+        a dict lookup instead of an xpath over the whole document. Of
+        non-distinct items, the one with the newer __lastModified survives;
+        if both are equally old, we keep the old one. Only items that end up
+        in self are copied; moduleN remains unchanged.
+        """
+        d1moduleN = XPATH["module"](self.etree, mtype=mtype)[0]
+        for newItemN in moduleN.iterchildren(
+            "{http://www.zetcom.com/ria/ws/module}moduleItem"
+        ):
+            newID = newItemN.get("id")
+            oldItemN = self._lookup(mtype=mtype, ID=newID)
+            if oldItemN is None:
                 # itemN does not exist in old doc -> copy it over
-                d1moduleN = self.xpath(
-                    f"/m:application/m:modules/m:module[@name = '{mtype}']"
-                )[0]
-                d1moduleN.append(newItemN)
-            else:
-                # itemN exists already, now take the newer one
-                oldItemLastModified = self._standardDT(inputN=oldItemN)
-                newItemLastModified = self._standardDT(inputN=newItemN)
-
-                if oldItemLastModified < newItemLastModified:
-                    # take newItem
-                    oldItemN = newItemN  # this will probably not work, but we can debug that later
-                    # else: keep oldItem = do nothing
+                copyN = deepcopy(newItemN)
+                d1moduleN.append(copyN)
+                self._index[(mtype, newID)] = copyN
+            elif self._standardDT(inputN=oldItemN) < self._standardDT(inputN=newItemN):
+                # itemN exists already, but new one is newer -> replace old
+                copyN = deepcopy(newItemN)
+                oldItemN.getparent().replace(oldItemN, copyN)
+                self._index[(mtype, newID)] = copyN
+            # else: keep oldItem = do nothing
 
     def _dropAttribs(self, *, attrib: str, xpath: str):
-        elemL: list[ET] = self.etree.xpath(xpath, namespaces=NSMAP)
+        elemL: list[ET] = self.xpath(xpath)
         for elemN in elemL:
             try:
                 del elemN.attrib[attrib]
@@ -1083,7 +1211,7 @@ class Module(Helper):
         if parent is None:
             parent = self.etree
 
-        elemL: list[ET] = parent.xpath(f"//m:{element}", namespaces=NSMAP)
+        elemL: list[ET] = compile_xpath(f"//m:{element}")(parent)
         for elemN in elemL:
             elemN.getparent().remove(elemN)
 
@@ -1093,7 +1221,7 @@ class Module(Helper):
         """
         # print(f"+++//m:{element}[@name = {name}]")
 
-        elemL = self.etree.xpath(f"//m:{element}[@name = '{name}']", namespaces=NSMAP)
+        elemL = self.xpath(f"//m:{element}[@name = $name]", name=name)
         for elemN in elemL:
             # print(f"-----------{elemN}")
             elemN.getparent().remove(elemN)
@@ -1103,6 +1231,77 @@ class Module(Helper):
         We want to eliminate identNr as part of sanitizing xml for upload form.
         """
 
+    def _itemIndex(self) -> dict[tuple[str, str], ET]:
+        """
+        Return the item index {(mtype, id): moduleItem}; builds it in one pass
+        over the document if it doesn't exist yet. IDs are stored as str like in
+        the xml.
+        """
+        if self._index is None:
+            index = {}
+            for moduleN in XPATH["moduleL"](self.etree):
+                mtype = moduleN.get("name")
+                for itemN in moduleN.iterchildren(
+                    "{http://www.zetcom.com/ria/ws/module}moduleItem"
+                ):
+                    index[(mtype, itemN.get("id"))] = itemN
+            self._index = index
+        return self._index
+
+    def _lookup(self, *, mtype: str, ID: int | str) -> ET | None:
+        """
+        Return the moduleItem for mtype and ID from the item index or None.
+
+        If the indexed item has been removed or moved in the meantime (e.g. by
+        lxml directly), we rebuild the index once.
+        """
+        key = (mtype, str(ID))
+        itemN = self._itemIndex().get(key)
+        if itemN is not None and not self._inDocument(itemN=itemN, mtype=mtype):
+            self.reindex()
+            itemN = self._index.get(key)
+        return itemN
+
+    def _inDocument(self, *, itemN: ET, mtype: str) -> bool:
+        """
+        Is itemN (still) a moduleItem in module[@name = mtype] of self?
+        """
+        moduleN = itemN.getparent()
+        if moduleN is None or moduleN.get("name") != mtype:
+            return False
+        modulesN = moduleN.getparent()
+        if modulesN is None:
+            return False
+        rootN = self.etree
+        if isinstance(rootN, etree._ElementTree):
+            rootN = rootN.getroot()
+        return modulesN.getparent() is rootN
+
+    @staticmethod
+    def _iterparse(*, source: Any, mtype: str | None = None) -> Iterator[ET]:
+        """
+        Core of iterfile: iterparse source (a path or a file object) and yield
+        moduleItems, removing processed items from the partial tree.
+        """
+        for _, itemN in etree.iterparse(
+            source,
+            events=("end",),
+            tag="{http://www.zetcom.com/ria/ws/module}moduleItem",
+            remove_blank_text=True,
+        ):
+            moduleN = itemN.getparent()
+            if (
+                moduleN is None
+                or moduleN.tag != "{http://www.zetcom.com/ria/ws/module}module"
+            ):
+                continue  # not a top-level moduleItem
+            if mtype is None or moduleN.get("name") == mtype:
+                yield itemN
+            # free memory of this and of earlier items
+            itemN.clear()
+            while itemN.getprevious() is not None:
+                del moduleN[0]
+
     def _parse_ident_in_parts(self, *, nr):  # xxx
         partsL = [x.strip() for x in nr.split()]
         part1 = partsL[0]
@@ -1111,31 +1310,176 @@ class Module(Helper):
 
         return [part1, part2, part3]
 
-    def _standardDT(self, *, inputN) -> str:
+    @staticmethod
+    def _standardDT(*, inputN) -> str:
         """
         For a given node containing a dateTime return the date in "standard form"
         as string. The standard form omits special symbols such as TZ and space.
         Also it provides only the first 14 digits, yyyymmddhhmmss b/c they always
-        exist, so the resulting number has always the same length. The upshot is
-        that the result can be compared in xpath v1 as a number.
-        """
-        xp = "translate(m:systemField[@name ='__lastModified']/m:value,'-:.TZ ','')"
-        new = inputN.xpath(xp, namespaces=NSMAP)
-        if len(str(new)) > 13:  # zero-based Python, so 13 is 14
-            new = int(str(new)[:13])
-        elif len(str(new)) < 13:
-            raise TypeError(
-                f"The 'since' argument is in an unexpected format ({new} is too short)!"
-            )
-        # print(f"***{new}")
-        return new
+        exist, so the resulting strings have always the same length and can be
+        compared directly.
+
+        Returns an empty string if the node has no __lastModified, so that an
+        item without date is always older than one with a date.
+        """
+        new = str(XPATH["lastModified"](inputN))
+        return new[:14]
+
+    def _syncTotalSize(self) -> None:
+        """
+        Update totalSize if items have been added since the last update
+        (addItem and add only mark the document as dirty).
+        """
+        if self._dirty:
+            self.updateTotalSize()
 
     def _types(self) -> set:
         """Returns a set of module types that exist in the document."""
         knownTypes = set()
-        moduleL = self.xpath("/m:application/m:modules/m:module")
+        moduleL = XPATH["moduleL"](self.etree)
 
         for moduleN in moduleL:
             moduleA = moduleN.attrib
             knownTypes.add(moduleA["name"])
         return knownTypes
+
+
+class ModuleWriter:
+    """
+    Writes a module document incrementally, so that a document doesn't have to
+    exist in memory as a whole. Writes <application><modules> once and a
+    <module> element whenever the mtype of the added items changes.
+
+    USAGE
+        with ModuleWriter(path="pack.xml") as w:
+            w.add(itemN=itemN)                 # mtype from itemN's parent
+            w.add(itemN=itemN, mtype="Person") # or explicitly
+
+    EXPECTS
+    * path: if the suffix is .zip, the document is written as the single
+      member {path.stem}.xml of a new LZMA zip file (like Helper.toZip);
+      otherwise as plain xml.
+    * totalSize (optional): if True (default), every <module> gets a
+      totalSize attribute with the number of its items.
+    * validate (optional): if True, every item is validated against the
+      module schema as it is added (see helper.validate_item), so invalid
+      data dies early without validating the whole document afterwards.
+
+    CAVEATS
+    * Items of one mtype have to be added in one go; adding an mtype again
+      after another mtype has been written raises ValueError.
+    * With totalSize, the items of the current module are spooled (in memory
+      up to spoolSize, then to a temporary file) and the <module> start tag
+      is written with the final count once the module is complete. With
+      totalSize=False items are written directly.
+    * The document is written as bytes, not with etree.xmlfile: xmlfile can
+      only write elements or escaped text, so it can't emit a start tag
+      after the spooled items it belongs to. Items are serialized one by
+      one with etree.tostring, which declares the default namespace on
+      every moduleItem again; that declaration is dropped (see _serialize),
+      since <application> declares it once for the whole document.
+    * If an exception occurs inside the with block, the incomplete output
+      file is deleted.
+    """
+
+    spoolSize = 16 * 1024 * 1024  # bytes per module kept in memory
+    _redundant = f'<moduleItem xmlns="{NSMAP["m"]}"'.encode()
+
+    def __init__(
+        self, *, path: Path | str, totalSize: bool = True, validate: bool = False
+    ) -> None:
+        self.path = Path(path)
+        self.totalSize = totalSize
+        self.validate = validate
+        self.counts: dict[str, int] = {}  # no of items per mtype
+
+    def __enter__(self) -> Self:
+        self._zip = None
+        if self.path.suffix.lower() == ".zip":
+            self._zip = ZipFile(self.path, "w", compression=ZIP_LZMA)
+            member = self.path.with_suffix(".xml").name
+            self._f = self._zip.open(member, "w", force_zip64=True)
+        else:
+            self._f = open(self.path, "wb")
+        self._mtype: str | None = None
+        self._spool = None
+        self._out = self._f  # where items go: output or spool
+        self._f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        self._f.write(f'<application xmlns="{NSMAP["m"]}">\n<modules>\n'.encode())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self._closeModule()
+                self._f.write(b"</modules>\n</application>\n")
+        finally:
+            if self._spool is not None:
+                self._spool.close()
+            self._f.close()
+            if self._zip is not None:
+                self._zip.close()
+            if exc_type is not None:
+                self.path.unlink(missing_ok=True)
+
+    def add(self, *, itemN: ET, mtype: str | None = None) -> None:
+        """
+        Write a single moduleItem to the document. If mtype is not given,
+        we take it from the name of the module itemN is in.
+        """
+        if mtype is None:
+            mtype = itemN.getparent().get("name")
+        if self.validate:
+            validate_item(itemN, mtype=mtype)
+        if mtype != self._mtype:
+            self._openModule(mtype=mtype)
+        self._out.write(self._serialize(itemN))
+        self.counts[mtype] += 1
+
+    def addModule(self, *, data: Module) -> None:
+        """
+        Write all moduleItems of a Module object.
+        """
+        for itemN in data:
+            self.add(itemN=itemN)
+
+    #
+    # private
+    #
+
+    def _closeModule(self) -> None:
+        if self._mtype is None:
+            return
+        if self._spool is not None:
+            self._f.write(self._startTag(mtype=self._mtype))
+            self._spool.seek(0)
+            shutil.copyfileobj(self._spool, self._f)
+            self._spool.close()
+            self._spool = None
+        self._f.write(b"</module>\n")
+        self._mtype = None
+
+    def _openModule(self, *, mtype: str) -> None:
+        if mtype in self.counts:
+            raise ValueError(f"Items of module '{mtype}' have to be added in one go")
+        self._closeModule()
+        if self.totalSize:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=self.spoolSize)
+            self._out = self._spool
+        else:
+            self._f.write(self._startTag(mtype=mtype))
+            self._out = self._f
+        self._mtype = mtype
+        self.counts[mtype] = 0
+
+    def _serialize(self, itemN: ET) -> bytes:
+        xml = etree.tostring(itemN, pretty_print=True, with_tail=False)
+        if xml.startswith(self._redundant):
+            xml = b"<moduleItem" + xml[len(self._redundant) :]
+        return xml
+
+    def _startTag(self, *, mtype: str) -> bytes:
+        tag = f"<module name={quoteattr(mtype)}"
+        if self.totalSize:
+            tag += f' totalSize="{self.counts[mtype]}"'
+        return f"{tag}>\n".encode()
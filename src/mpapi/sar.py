@@ -67,8 +67,9 @@ additional numbers (referencing fractions of seconds).
 """
 
 from lxml import etree
-from mpapi.client import MpApi
-from mpapi.constants import NSMAP
+from mpapi.client import MpApi, TransportPolicy
+from mpapi.constants import NSMAP, XPATH
+from mpapi.downloader import Downloader
 from mpapi.module import Module
 from mpapi.search import Search
 from pathlib import Path
@@ -78,8 +79,15 @@ ETparser = etree.XMLParser(remove_blank_text=True)
 
 
 class Sar:
-    def __init__(self, *, baseURL: str, user: str, pw: str) -> None:
-        self.api = MpApi(baseURL=baseURL, user=user, pw=pw)
+    def __init__(
+        self,
+        *,
+        baseURL: str,
+        user: str,
+        pw: str,
+        policy: TransportPolicy | None = None,
+    ) -> None:
+        self.api = MpApi(baseURL=baseURL, user=user, pw=pw, policy=policy)
         self.user = user
 
     def _getBy(self, *, module: str, Id: int, field: str, since=None) -> Module:
@@ -158,15 +166,7 @@ class Sar:
 
         # 2600647 = SMB-Digital
         m = self.api.getItem2(mtype=mtype, ID=ID)
-        r = m.xpath(
-            f"""/m:application/m:modules/m:module[
-                @name = '{mtype}']/m:moduleItem[
-                @id = {ID}]/m:repeatableGroup[
-                @name = 'ObjPublicationGrp']/m:repeatableGroupItem[
-                    m:vocabularyReference[@name='PublicationVoc']/m:vocabularyReferenceItem[@name='Ja'] 
-                    and m:vocabularyReference[@name='TypeVoc']/m:vocabularyReferenceItem[@id = 2600647]
-                ]"""
-        )
+        r = XPATH["objApproved"](m.etree, mtype=mtype, ID=str(ID))
         if len(r) > 0:
             return True
         else:
@@ -266,7 +266,7 @@ class Sar:
         """
         if module == "Exhibition":  # api.getItem should be faster than sar
             r = self.api.getItem(module=module, id=Id)
-            return Module(xml=r.text)
+            return Module(xml=r.content)
 
         fields: dict = {
             "Multimedia": "MulObjectRef.ObjRegistrarRef.RegExhibitionRef.__id",
@@ -303,7 +303,9 @@ class Sar:
         }
         return self._getBy(module=module, Id=Id, field=fields[module], since=since)
 
-    def saveAttachments(self, *, data: Module, adir: Path, since=None) -> set[Path]:
+    def saveAttachments(
+        self, *, data: Module, adir: Path, since=None, workers: int = 4
+    ) -> set[Path]:
         """
         For a set of multimedia moduleItems (provided in xml), download their attachments.
         Attachments are saved to disk with the filename {mulId}.{ext}.
@@ -313,6 +315,7 @@ class Sar:
         * adir: directory to save the attachments to
         * since (optional): xs:date or xs:dateTime; if provided will only get attachments
           of media that are newer than this date
+        * workers (optional): number of concurrent downloads (see Downloader)
 
         Returns
         * a set with the paths of the identified attachments; can be counted
@@ -331,17 +334,7 @@ class Sar:
         * optional arg since 20211226
         """
         if since is None:
-            xp = """
-                /m:application/m:modules/m:module[
-                    @name='Multimedia'
-                ]/m:moduleItem[
-                    @hasAttachments = 'true'
-                    and ./m:repeatableGroup[@name = 'MulApprovalGrp']/m:repeatableGroupItem[
-                        ./m:vocabularyReference[@name = 'TypeVoc']/m:vocabularyReferenceItem[@name = 'SMB-digital']
-                        and ./m:vocabularyReference[@name = 'ApprovalVoc']/m:vocabularyReferenceItem[@name = 'Ja']
-                    ]
-                ]            
-            """
+            itemsL = XPATH["mulApprovedWithAttachment"](data.etree)
         else:
             print(f" filtering multimedia records that have changed since {since}")
             """
@@ -357,32 +350,18 @@ class Sar:
             I define a standardized form which has 14 digits minimum (8 + 6), i.e. one digit after the period
             where should this rewriting of the since argument took place? Not here.
             """
-
-            xp = f"""
-                /m:application/m:modules/m:module[
-                    @name='Multimedia'
-                ]/m:moduleItem[
-                    @hasAttachments = 'true'
-                    and ./m:repeatableGroup[@name = 'MulApprovalGrp']/m:repeatableGroupItem[
-                        ./m:vocabularyReference[@name = 'TypeVoc']/m:vocabularyReferenceItem[@name = 'SMB-digital']
-                        and ./m:vocabularyReference[@name = 'ApprovalVoc']/m:vocabularyReferenceItem[@name = 'Ja']
-                    ]
-                    and ./m:systemField[
-                        @name = '__lastModified'
-                        and substring(translate(m:value,'-:.TZ ',''),0, 14) > 
-                        substring(translate('{since}','-:.TZ ',''), 0, 14)
-                    ]
-                ]
-            """
-        # print(xp)
-        itemsL = data.xpath(xp)
+            itemsL = XPATH["mulApprovedWithAttachmentSince"](
+                data.etree, since=str(since)
+            )
         print(
             f" xml has {len(itemsL)} records with attachment=True and Freigabe[@typ='SMB-Digital'] = Ja"
         )
-        return self._saveAttachments(moduleItemL=itemsL, adir=adir, since=since)
+        return self._saveAttachments(
+            moduleItemL=itemsL, adir=adir, since=since, workers=workers
+        )
 
     def _saveAttachments(
-        self, *, moduleItemL: list, adir: Path, since=None
+        self, *, moduleItemL: list, adir: Path, since=None, workers: int = 4
     ) -> set[Path]:
         """
         the L in moduleItemL stands for nodeList. So it expects a list of nodes instead of
@@ -398,22 +377,28 @@ class Sar:
         # Why do i get suffix from old filename? Is that really the best source?
         # Seems that it is. I see no other field in RIA
         positives = set()
+        jobs = []
         for itemN in moduleItemL:
             # itemA = itemN.attrib
             # mmId = itemA["id"]
             mmId = itemN.attrib["id"]
-            fn_old = itemN.xpath(
-                "m:dataField[@name = 'MulOriginalFileTxt']/m:value/text()",
-                namespaces=NSMAP,
-            )[0]  # assuming that there can be only one
+            fn_old = XPATH["dateiname"](itemN)[0]  # assuming that there can be only one
             fn = mmId + Path(fn_old).suffix
             mm_fn = Path(adir).joinpath(fn)
             positives.add(mm_fn)
-            if not mm_fn.exists():  # only d/l if doesn't exist yet
+            # only d/l if doesn't exist yet or is incomplete
+            if not self.api.verifyAttachment(path=mm_fn):
                 print(f" getting {mm_fn}")
-                self.api.saveAttachment(module="Multimedia", id=mmId, path=mm_fn)
+                jobs.append((mmId, mm_fn))
             else:
                 print(f" {mm_fn} exists already")
+        report = Downloader(api=self.api, workers=workers).run(
+            jobs=jobs, module="Multimedia"
+        )
+        if report["failed"]:
+            # the other downloads are done; raise the first error like before
+            ID, path, e = report["failed"][0]
+            raise e
         return positives
 
     def search(self, *, query: Search) -> Module:
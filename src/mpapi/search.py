@@ -65,7 +65,7 @@ EXAMPLE
 
 from lxml import etree  # type: ignore
 from mpapi.helper import Helper
-from mpapi.constants import NSMAP
+from mpapi.constants import XPATH
 from typing import Optional
 
 # xpath 1.0 and lxml don't empty string or None for default ns
@@ -94,6 +94,18 @@ allowedOperators = {
     "startsWithTerm",
 }  # let's use an inmutable set
 
+# names of elements in the module xml which are not part of a field path
+_elementNames = {
+    "dataField",
+    "moduleReferenceItem",
+    "repeatableGroupItem",
+    "systemField",
+    "value",
+    "virtualField",
+    "vocabularyReference",
+    "vocabularyReferenceItem",
+}
+
 
 class Search(Helper):
     def __init__(
@@ -137,9 +149,7 @@ class Search(Helper):
 
             # lastN is a state; state is bad
             # lastN is used in addCriterion and _addConjunction
-            self.lastN = self.etree.xpath(
-                "/s:application/s:modules/s:module/s:search/s:expert", namespaces=NSMAP
-            )[0]
+            self.lastN = XPATH["expert"](self.etree)[0]
 
     def addCriterion(self, *, operator: str, field: str, value: str = None) -> None:
         if operator not in allowedOperators:
@@ -159,30 +169,38 @@ class Search(Helper):
                 operand=value,
             )
 
-    def addField(self, *, field) -> None:
+    def addField(self, *, field: str) -> None:
         """
-        should add field to query to limit response to listed fields
+        Add field to query to limit response to listed fields.
 
-        I just noticed that there are situations where this method doesn't work, e.g.
-        when trying to run a saved query which has no element below search.
-        """
+        Fields can be given as RIA field paths (ObjMultimediaRef.ThumbnailBoo)
+        or as paths along the xml response
+        (ObjMultimediaRef.moduleReferenceItem.dataField.ThumbnailBoo); the
+        latter are normalized to the former. Adding the same field twice
+        doesn't add a second field element.
 
+        NEW: Also works for queries without expert element below search, e.g.
+        saved queries.
+        """
+        fieldPath = ".".join(
+            step for step in field.split(".") if step not in _elementNames
+        )
         try:
-            selectN = self.etree.xpath(
-                "/s:application/s:modules/s:module/s:search/s:select", namespaces=NSMAP
-            )[0]
-        except Exception:
-            expertN = self.etree.xpath(
-                "/s:application/s:modules/s:module/s:search/s:expert", namespaces=NSMAP
-            )[0]
+            selectN = XPATH["select"](self.etree)[0]
+        except IndexError:
+            # select has to be the first element in search
+            searchN = XPATH["search"](self.etree)[0]
             selectN = etree.Element(
                 "{http://www.zetcom.com/ria/ws/module/search}select"
             )
-            expertN.addprevious(selectN)
+            searchN.insert(0, selectN)
+        for fieldN in selectN:
+            if fieldN.get("fieldPath") == fieldPath:
+                return
         etree.SubElement(
             selectN,
             "{http://www.zetcom.com/ria/ws/module/search}field",
-            fieldPath=field,
+            fieldPath=fieldPath,
         )
 
     def exists(self, *, field: str) -> None:
@@ -241,9 +259,7 @@ class Search(Helper):
         )
 
     def _attribute(self, *, value, key) -> int:
-        searchN = self.etree.xpath(
-            "/s:application/s:modules/s:module/s:search", namespaces=NSMAP
-        )[0]
+        searchN = XPATH["search"](self.etree)[0]
         searchA = searchN.attrib
         if value is None:  # getter
             return int(searchA[key])
@@ -6,7 +6,7 @@ Load vocabulary documents in analogy to mpapi.module
 
 from lxml import etree
 from mpapi.helper import Helper
-from mpapi.constants import parser
+from mpapi.constants import XPATH, parser
 from typing import Any, Optional
 
 
@@ -25,7 +25,7 @@ class Vocabulary(Helper):
             for node in v:
                 #do something with node
         """
-        nodesL = self.xpath("//v:node")
+        nodesL = XPATH["vocNodes"](self.etree)
         yield from [nodeN for nodeN in nodesL]
 
     def __len__(self):
@@ -43,4 +43,4 @@ class Vocabulary(Helper):
         to check type:
             isinstance(v, Vocabulary)
         """
-        return int(self.xpath("count(//v:node|/v:instance)"))
+        return int(XPATH["vocCount"](self.etree))
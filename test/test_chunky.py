@@ -1,5 +1,5 @@
 from mpapi.constants import NSMAP, get_credentials
-from mpapi.chunky import Chunky
+from mpapi.chunky import Chunky, RelatedCache
 from mpapi.module import Module
 from lxml import etree  # type: ignore
 
@@ -86,3 +86,91 @@ def test_getByOtherTypes():
                 break
             no += 1
         print("Stopping after 3")
+
+
+def test_relatedQuery():
+    # no http
+    c = Chunky(chunkSize=1, baseURL=baseURL, pw=pw, user=user, batchSize=2)
+    s = c._relatedQuery(IDs=[1, 2], target="Person", since="2021-01-01")
+    assert s.xpath("count(//s:and/s:or/s:equalsField)") == 2
+    assert s.xpath("count(//s:and/s:greater)") == 1
+    s = c._relatedQuery(IDs=[1], target="Multimedia", onlyPublished=True)
+    assert s.xpath("count(//s:and/s:not/s:or/s:endsWithTerm)") == 4
+
+
+def test_relatedCache(tmp_path):
+    # no http
+    def item(ID, lastModified):
+        xml = f"""<application xmlns="{NSMAP["m"]}"><modules><module name="Person">
+            <moduleItem id="{ID}"><systemField name="__lastModified">
+            <value>{lastModified}</value></systemField></moduleItem>
+            </module></modules></application>"""
+        return Module(xml=xml)[("Person", ID)]
+
+    cache = RelatedCache(maxItems=1, spillDir=tmp_path)
+    cache.put(itemN=item(1, "2021-01-02 00:00:00.000"), mtype="Person")
+    cache.put(itemN=item(1, "2021-01-01 00:00:00.000"), mtype="Person")  # older
+    cache.put(itemN=item(2, "2021-01-01 00:00:00.000"), mtype="Person")  # spills 1
+    assert len(cache) == 2
+    itemN = cache.get(mtype="Person", ID=1)
+    assert itemN.xpath("string(.//m:value)", namespaces=NSMAP).startswith("2021-01-02")
+    assert cache.get(mtype="Person", ID=3) is None
+    cache.miss(mtype="Person", ID=3)
+    assert cache.missing(mtype="Person", ID=3)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_paginate_growing_set():
+    # no http; the set grows from 2500 to 3200 items while we fetch
+    c = Chunky(chunkSize=1000, baseURL=baseURL, pw=pw, user=user, workers=2)
+    fetched = []
+
+    def fetch(offset):
+        fetched.append(offset)
+        n = max(0, min(1000, 3200 - offset))
+        items = "".join(f'<moduleItem id="{offset + i}"/>' for i in range(n))
+        xml = f"""<application xmlns="{NSMAP["m"]}"><modules>
+            <module name="Object">{items}</module></modules></application>"""
+        return Module(xml=xml)
+
+    chunks = list(c._paginate(fetch=fetch, offset=0, total=2500))
+    assert sorted(fetched) == [0, 1000, 2000, 3000]
+    assert [m.actualSize(module="Object") for m in chunks] == [1000, 1000, 1000, 200]
+
+
+def test_request_slots():
+    # no http; nested pools share workers request slots
+    import threading
+    import time
+
+    c = Chunky(chunkSize=10, baseURL=baseURL, pw=pw, user=user, workers=2)
+    c.batchSize = 1
+    lock = threading.Lock()
+    running = [0, 0]  # now, max
+
+    def search2(*, query):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return Module()
+
+    c.api.search2 = search2
+    refs = "".join(f'<moduleReferenceItem moduleItemId="{i}"/>' for i in range(4))
+    xml = f"""<application xmlns="{NSMAP["m"]}"><modules><module name="Object">
+        <moduleItem id="1">
+          <moduleReference name="ObjMultimediaRef" targetModule="Multimedia">{refs}</moduleReference>
+          <moduleReference name="ObjPerAssociationRef" targetModule="Person">{refs}</moduleReference>
+        </moduleItem></module></modules></application>"""
+
+    def fetch(offset):
+        return c._chunk(part=Module(xml=xml))
+
+    list(c._inOrder(fetch=fetch, args=range(4)))
+    assert running[1] == 2
+    assert (
+        c.api.session.get_adapter("https://x").poolmanager.connection_pool_kw["maxsize"]
+        == 2
+    )
@@ -0,0 +1,256 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+from mpapi.client import CircuitOpen, MpApi, TransportPolicy
+import pytest
+import requests
+import threading
+
+# no http: the session is replaced by a stub that answers with canned
+# status codes or exceptions
+
+
+class StubSession:
+    def __init__(self, answers: list) -> None:
+        self.answers = list(answers)
+        self.calls = []
+        self.sent = []  # bytes per upload
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(method)
+        body = kwargs.get("data")
+        if hasattr(body, "read"):  # streamed upload
+            self.sent.append(sum(len(block) for block in body))
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        r = requests.Response()
+        r.status_code = answer
+        r.url = url
+        r._content = b""
+        r.raw = io.BytesIO()
+        return r
+
+
+def api(answers: list, **kwargs) -> MpApi:
+    policy = TransportPolicy(backoff=0, **kwargs)
+    client = MpApi(baseURL="http://stub", user="u", pw="p", policy=policy)
+    client.session = StubSession(answers)
+    return client
+
+
+def test_retry():
+    c = api([503, requests.ConnectionError("reset"), 200])
+    assert c._get("http://stub/x").status_code == 200
+    assert c.session.calls == ["GET"] * 3
+    assert c.stats["requests"] == 3
+    assert c.stats["retries"] == 2
+    assert c.stats["failures"] == 2
+
+    c = api([503, 503], retries=1)
+    with pytest.raises(requests.HTTPError):
+        c._get("http://stub/x")
+    assert c.stats["requests"] == 2
+
+
+def test_post_not_idempotent():
+    # a POST that may have been processed is not sent again
+    c = api([503, 200])
+    with pytest.raises(requests.HTTPError):
+        c._post("http://stub/x", data="<xml/>")
+    assert c.session.calls == ["POST"]
+
+    c = api([requests.ReadTimeout("slow"), 200])
+    with pytest.raises(requests.ReadTimeout):
+        c._post("http://stub/x", data="<xml/>")
+
+    # but 429 and searches (idempotent=True) are retried
+    c = api([429, 200])
+    assert c._post("http://stub/x", data="<xml/>").status_code == 200
+    c = api([503, 200])
+    assert c._post("http://stub/x", data="<xml/>", idempotent=True).ok
+
+
+def test_breaker():
+    # breaker opened by the request's own failures: it waits and goes on
+    c = api([503, 503, 200], breakerThreshold=2, breakerCooldown=0.05)
+    assert c._get("http://stub/x").status_code == 200
+    assert c.stats["breakerOpened"] == 1
+
+    # new requests fail fast while the breaker is open
+    c = api([503, 200], retries=0, breakerThreshold=1, breakerCooldown=60)
+    with pytest.raises(requests.HTTPError):
+        c._get("http://stub/x")
+    with pytest.raises(CircuitOpen):
+        c._get("http://stub/x")
+    assert c.stats["rejected"] == 1
+    assert c.session.calls == ["GET"]
+
+
+def test_saveAttachment_retries(tmp_path):
+    # one retry layer: retries=1 means two attempts, not (1 + 1)²
+    c = api([requests.ConnectionError("reset")] * 4, retries=1)
+    with pytest.raises(requests.ConnectionError):
+        c.saveAttachment(id=1, path=tmp_path / "1.jpg")
+    assert c.session.calls == ["GET"] * 2
+    assert c.stats["resumes"] == 1
+    assert c.stats["retries"] == 0
+
+    c = api([503] * 4, retries=1)
+    with pytest.raises(requests.HTTPError):
+        c.saveAttachment(id=1, path=tmp_path / "1.jpg")
+    assert c.session.calls == ["GET"] * 2
+    assert c.stats["retries"] == 1
+
+    c = api([503, 200], retries=1)
+    c.saveAttachment(id=1, path=tmp_path / "1.jpg")
+    assert (tmp_path / "1.jpg").exists()
+
+
+def test_updateAttachment(tmp_path):
+    path = tmp_path / "1.jpg"
+    path.write_bytes(b"x" * 3_000_000)
+    progress = []
+
+    # retried PUT reads the file again, but it's counted only once
+    c = api([503, 200])
+    c.updateAttachment(module="Multimedia", id=1, path=path, callback=progress.append)
+    assert c.session.sent == [3_000_000, 3_000_000]
+    assert sum(progress) == 3_000_000
+
+    progress = []
+    c = api([200, 200])
+    failed = c.updateAttachments(
+        mapping={1: path, 2: tmp_path / "missing.jpg", 3: path},
+        workers=2,
+        callback=progress.append,
+    )
+    assert list(failed) == [2]
+    assert isinstance(failed[2], FileNotFoundError)
+    assert c.session.sent == [3_000_000, 3_000_000]
+    assert sum(progress) == 6_000_000
+
+
+#
+# attachment downloads against a local http.server
+#
+
+
+class AttachmentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    content = b""
+    etag = '"v1"'
+    mode = "ok"  # ok | break (send half and close) | short (lie in Content-Range)
+    requests = []  # (Range, If-Range) per request
+
+    def do_GET(self):
+        cls = type(self)
+        rng = self.headers.get("Range")
+        ifRange = self.headers.get("If-Range")
+        cls.requests.append((rng, ifRange))
+        body = cls.content
+        start = 0
+        if rng and (ifRange is None or ifRange == cls.etag):
+            start = int(rng.split("=")[1].rstrip("-"))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            total = len(body) * 2 if cls.mode == "short" else len(body)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{total}")
+        else:
+            self.send_response(200)
+            self.send_header("ETag", cls.etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        if cls.mode == "break":
+            cls.mode = "ok"  # only once
+            self.wfile.write(body[start : start + (len(body) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    AttachmentHandler.content = b"0123456789" * 10000
+    AttachmentHandler.etag = '"v1"'
+    AttachmentHandler.mode = "ok"
+    AttachmentHandler.requests = []
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), AttachmentHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    policy = TransportPolicy(backoff=0, retries=2)
+    baseURL = f"http://127.0.0.1:{srv.server_port}"
+    yield MpApi(baseURL=baseURL, user="u", pw="p", policy=policy)
+    srv.shutdown()
+
+
+def test_saveAttachment_resume(server, tmp_path):
+    path = tmp_path / "1.jpg"
+    AttachmentHandler.mode = "break"
+    server.saveAttachment(id=1, path=path)
+    assert path.read_bytes() == AttachmentHandler.content
+    assert server.stats["resumes"] == 1
+    rng, ifRange = AttachmentHandler.requests[1]
+    assert rng.startswith("bytes=") and rng != "bytes=0-"
+    assert ifRange == '"v1"'
+    assert server.verifyAttachment(path=path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [".sizes", "1.jpg"]
+
+
+def test_saveAttachment_changed(server, tmp_path):
+    # part from an earlier run, but the attachment has been replaced since
+    path = tmp_path / "1.jpg"
+    (tmp_path / "1.jpg.part").write_bytes(b"old" * 10)
+    (tmp_path / ".1.jpg.part.validator").write_text('"v0"')
+    server.saveAttachment(id=1, path=path)
+    assert path.read_bytes() == AttachmentHandler.content
+
+    # part without validator is not resumed at all
+    (tmp_path / "1.jpg.part").write_bytes(b"old" * 10)
+    server.saveAttachment(id=1, path=path)
+    assert AttachmentHandler.requests[-1] == (None, None)
+    assert path.read_bytes() == AttachmentHandler.content
+
+
+def test_saveAttachment_416(server, tmp_path):
+    path = tmp_path / "1.jpg"
+    (tmp_path / "1.jpg.part").write_bytes(b"x" * 200000)  # longer than the file
+    (tmp_path / ".1.jpg.part.validator").write_text('"v1"')
+    server.saveAttachment(id=1, path=path)
+    assert path.read_bytes() == AttachmentHandler.content
+    assert [r[0] for r in AttachmentHandler.requests] == ["bytes=200000-", None]
+
+
+def test_saveAttachment_size_mismatch(server, tmp_path):
+    path = tmp_path / "1.jpg"
+    (tmp_path / "1.jpg.part").write_bytes(AttachmentHandler.content[:10])
+    (tmp_path / ".1.jpg.part.validator").write_text('"v1"')
+    AttachmentHandler.mode = "short"  # Content-Range claims twice the size
+    server.saveAttachment(id=1, path=path)
+    # the mismatch is not accepted; the .part is dropped (416) and downloaded again
+    assert server.stats["resumes"] == 1
+    assert [r[0] for r in AttachmentHandler.requests] == [
+        "bytes=10-",
+        "bytes=100000-",
+        None,
+    ]
+    assert path.read_bytes() == AttachmentHandler.content
+
+    AttachmentHandler.requests = []
+    policy = TransportPolicy(backoff=0, retries=0)
+    api = MpApi(
+        baseURL=server.appURL[: -len("/ria-ws/application")],
+        user="u",
+        pw="p",
+        policy=policy,
+    )
+    (tmp_path / "2.jpg.part").write_bytes(AttachmentHandler.content[:10])
+    (tmp_path / ".2.jpg.part.validator").write_text('"v1"')
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        api.saveAttachment(id=2, path=tmp_path / "2.jpg")
+    assert not (tmp_path / "2.jpg").exists()
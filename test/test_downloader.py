@@ -0,0 +1,117 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mpapi.client import MpApi, TransportPolicy
+from mpapi.downloader import Downloader, TokenBucket
+from mpapi.sar import Sar
+from lxml import etree  # type: ignore
+import pytest
+import requests
+import threading
+import time
+
+# downloads from a local http.server; attachments are b"{id}" * 1000,
+# id 404 doesn't exist
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    active = 0
+    maxActive = 0
+
+    def do_GET(self):
+        cls = type(self)
+        ID = self.path.split("/")[-2]
+        with cls.lock:
+            cls.active += 1
+            cls.maxActive = max(cls.maxActive, cls.active)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.active -= 1
+        if ID == "404":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = ID.encode() * 1000
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def baseURL():
+    Handler.active = Handler.maxActive = 0
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}"
+    srv.shutdown()
+
+
+def api(baseURL: str) -> MpApi:
+    return MpApi(baseURL=baseURL, user="u", pw="p", policy=TransportPolicy(retries=0))
+
+
+def test_run(baseURL, tmp_path):
+    c = api(baseURL)
+    jobs = [(ID, tmp_path / f"{ID}.jpg") for ID in (1, 2, 404, 3, 4, 5)]
+    report = Downloader(api=c, workers=6, perHost=2).run(jobs=jobs)
+    assert report["files"] == 5
+    assert report["bytes"] == 5000
+    assert [(ID, path) for ID, path, e in report["failed"]] == [
+        (404, tmp_path / "404.jpg")
+    ]
+    assert isinstance(report["failed"][0][2], requests.HTTPError)
+    assert (tmp_path / "3.jpg").read_bytes() == b"3" * 1000
+    assert not (tmp_path / "404.jpg").exists()
+    assert Handler.maxActive <= 2  # perHost
+
+    # pool is sized once and not made smaller by later Downloaders
+    Downloader(api=c, workers=12)
+    Downloader(api=c, workers=1)
+    assert c.session.get_adapter(baseURL)._pool_maxsize == 12
+
+
+def test_interrupt(baseURL, tmp_path):
+    # Ctrl-C doesn't wait for the queue; jobs that haven't started are cancelled
+    done = []
+
+    class Interrupted(Downloader):
+        def _download(self, *, module, ID, path):
+            if ID == 0:
+                raise KeyboardInterrupt
+            time.sleep(0.1)
+            done.append(ID)
+
+    dl = Interrupted(api=api(baseURL), workers=1)
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        dl.run(jobs=[(ID, tmp_path / f"{ID}") for ID in range(20)])
+    assert time.monotonic() - start < 1
+    time.sleep(0.3)
+    assert len(done) <= 1
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1_000_000)
+    start = time.monotonic()
+    for _ in range(20):
+        bucket.take(10_000)
+    assert 0.15 < time.monotonic() - start < 1
+
+
+def test_sar_failed(baseURL, tmp_path):
+    xml = """
+    <moduleItem xmlns="http://www.zetcom.com/ria/ws/module" id="{ID}">
+      <dataField name="MulOriginalFileTxt"><value>a.jpg</value></dataField>
+    </moduleItem>"""
+    itemL = [etree.fromstring(xml.format(ID=ID)) for ID in (1, 404)]
+    sar = Sar(baseURL=baseURL, user="u", pw="p", policy=TransportPolicy(retries=0))
+    with pytest.raises(requests.HTTPError):
+        sar._saveAttachments(moduleItemL=itemL[1:], adir=tmp_path)
+    assert sar._saveAttachments(moduleItemL=itemL[:1], adir=tmp_path) == {
+        tmp_path / "1.jpg"
+    }
@@ -0,0 +1,76 @@
+import logging
+from mpapi.filterUnpublished import filter_
+from mpapi.module import Module
+import zipfile
+
+em = "Ethnologisches Museum, Staatliche Museen zu Berlin"
+
+
+def chunk(no: int) -> str:
+    # per chunk: an EM and a non-EM object, a jpg and a pdf
+    return f"""
+    <application xmlns="http://www.zetcom.com/ria/ws/module">
+      <modules>
+        <module name="Object" totalSize="2">
+          <moduleItem id="{no}1">
+            <moduleReference name="ObjOwnerRef" targetModule="Address">
+              <moduleReferenceItem moduleItemId="9">
+                <formattedValue language="de">{em}</formattedValue>
+              </moduleReferenceItem>
+            </moduleReference>
+            <moduleReference name="ObjMultimediaRef" targetModule="Multimedia" size="2">
+              <moduleReferenceItem moduleItemId="{no}3"/>
+              <moduleReferenceItem moduleItemId="{no}4"/>
+            </moduleReference>
+          </moduleItem>
+          <moduleItem id="{no}2">
+            <moduleReference name="ObjOwnerRef" targetModule="Address">
+              <moduleReferenceItem moduleItemId="8">
+                <formattedValue language="de">Kunstbibliothek</formattedValue>
+              </moduleReferenceItem>
+            </moduleReference>
+          </moduleItem>
+        </module>
+        <module name="Multimedia" totalSize="2">
+          <moduleItem id="{no}3">
+            <dataField name="MulOriginalFileTxt"><value>a.jpg</value></dataField>
+          </moduleItem>
+          <moduleItem id="{no}4">
+            <dataField name="MulOriginalFileTxt"><value>b.pdf</value></dataField>
+          </moduleItem>
+        </module>
+      </modules>
+    </application>"""
+
+
+def members(target_dir) -> dict:
+    result = {}
+    for zip_fn in sorted(target_dir.glob("*.zip")):
+        with zipfile.ZipFile(zip_fn) as zf:
+            result[zip_fn.name] = zf.read(zip_fn.with_suffix(".xml").name)
+    return result
+
+
+def test_jobs(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    src_dir = tmp_path / "20240610"
+    src_dir.mkdir()
+    for no in range(1, 5):
+        Module(xml=chunk(no)).toZip(path=src_dir / f"query7-chunk{no}.xml")
+    target_dir = tmp_path / "20240610" / "filter"
+
+    filter_(src=str(src_dir / "query7-chunk1.zip"))
+    serial = members(target_dir)
+    assert len(serial) == 4
+    IDs = [
+        itemN.get("id") for itemN in Module.iterfile(target_dir / "query7-chunk3.zip")
+    ]
+    assert IDs == ["31", "33"]
+    caplog.clear()
+
+    filter_(src=str(src_dir / "query7-chunk1.zip"), jobs=2, force=True)
+    assert members(target_dir) == serial
+    # log records of the worker processes reach the main process
+    for no in range(1, 5):
+        assert f"DEL Multimedia {no}4" in caplog.text
+        assert f"DEL Object {no}2" in caplog.text
@@ -0,0 +1,107 @@
+from mpapi.client import MpApi
+from mpapi.constants import XPATH
+from mpapi.getAttachments import GetAttachments, update_zip
+from mpapi.module import Module
+import os
+import zipfile
+
+
+def test_update_zip(tmp_path):
+    src = tmp_path / "pix"
+    (src / "Standardbild").mkdir(parents=True)
+    for no, seconds in enumerate((1_700_000_001, 1_700_000_002, 1_700_000_003)):
+        path = src / "Standardbild" / f"{no}.jpg"
+        path.write_bytes(b"x" * (no + 1))
+        os.utime(path, (seconds, seconds))  # odd seconds, too
+    (src / ".sizes").write_text("skipped")
+    (src / "4.jpg.part").write_text("skipped")
+    zip_path = tmp_path / "pix.zip"
+
+    assert update_zip(src=src, zip_path=zip_path) == 3
+    assert update_zip(src=src, zip_path=zip_path) == 0  # nothing changed
+
+    (src / "3.txt").write_text("new")
+    changed = src / "Standardbild" / "1.jpg"
+    changed.write_bytes(b"changed")
+    assert update_zip(src=src, zip_path=zip_path) == 2
+    assert update_zip(src=src, zip_path=zip_path) == 0
+
+    with zipfile.ZipFile(zip_path) as zf:
+        names = zf.namelist()
+        assert sorted(names) == [
+            "3.txt",
+            "Standardbild/0.jpg",
+            "Standardbild/1.jpg",
+            "Standardbild/2.jpg",
+        ]
+        assert zf.read("Standardbild/1.jpg") == b"changed"
+        assert zf.getinfo("Standardbild/0.jpg").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("3.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_update_zip64(tmp_path, monkeypatch):
+    # entries over the zip64 limit are copied when the zip is rewritten
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 1000)
+    src = tmp_path / "pix"
+    src.mkdir()
+    (src / "big.jpg").write_bytes(b"x" * 5000)
+    (src / "small.jpg").write_bytes(b"x")
+    zip_path = tmp_path / "pix.zip"
+    assert update_zip(src=src, zip_path=zip_path) == 2
+    (src / "small.jpg").write_bytes(b"changed")
+    assert update_zip(src=src, zip_path=zip_path) == 1
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.read("big.jpg") == b"x" * 5000
+
+
+cornelia = """
+<application xmlns="http://www.zetcom.com/ria/ws/module">
+  <modules>
+    <module name="Object">
+      <moduleItem id="1">
+        <moduleReference name="ObjMultimediaRef" targetModule="Multimedia">
+          <moduleReferenceItem moduleItemId="10">
+            <dataField name="ThumbnailBoo"><value>true</value></dataField>
+          </moduleReferenceItem>
+          <moduleReferenceItem moduleItemId="11">
+            <dataField name="ThumbnailBoo"><value>false</value></dataField>
+          </moduleReferenceItem>
+        </moduleReference>
+      </moduleItem>
+    </module>
+    <module name="Multimedia">
+      <moduleItem id="10">
+        <dataField name="MulOriginalFileTxt"><value>a.jpg</value></dataField>
+      </moduleItem>
+      <moduleItem id="11">
+        <dataField name="MulOriginalFileTxt"><value>b.tif</value></dataField>
+      </moduleItem>
+      <moduleItem id="12">
+        <dataField name="MulOriginalFileTxt"><value>c.jpg</value></dataField>
+      </moduleItem>
+    </module>
+  </modules>
+</application>
+"""
+
+
+def test_cornelia(tmp_path):
+    # no search: a GetAttachments without job, as process_response sets it up
+    data = Module(xml=cornelia)
+    ga = GetAttachments.__new__(GetAttachments)
+    ga.conf = {"attachments": {"name": "Cornelia"}}
+    ga.force = False
+    ga.api = MpApi(baseURL="http://stub", user="u", pw="p")
+    ga.thumbnails = set(XPATH["thumbnailIds"](data.etree))
+    assert ga.thumbnails == {"10"}
+
+    paths = {}
+    for itemN in XPATH["itemsByType"](data.etree, mtype="Multimedia"):
+        ID = itemN.get("id")
+        path = ga._get_single_attachment(item=itemN, ID=ID, out_dir=tmp_path)
+        paths[ID] = path.relative_to(tmp_path).as_posix()
+    assert paths == {
+        "10": "Standardbild/10.jpg",
+        "11": "nichtStandardbild/11.tif",
+        "12": "nichtStandardbild/12.jpg",
+    }
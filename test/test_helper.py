@@ -0,0 +1,35 @@
+from mpapi.constants import XPATH
+from mpapi.helper import compile_xpath
+from mpapi.module import Module
+
+xml = """
+<application xmlns="http://www.zetcom.com/ria/ws/module">
+  <modules>
+    <module name="Object" totalSize="2">
+      <moduleItem id="1"/>
+      <moduleItem id="2"/>
+    </module>
+    <module name="Person" totalSize="1">
+      <moduleItem id="3"/>
+    </module>
+  </modules>
+</application>
+"""
+
+
+def test_compile_xpath():
+    path = "//m:module[@name = $mtype]/m:moduleItem/@id"
+    assert compile_xpath(path) is compile_xpath(path)  # parsed only once
+    hits = compile_xpath.cache_info().hits
+    m = Module(xml=xml)
+    assert m.xpath(path, mtype="Object") == ["1", "2"]
+    assert m.xpath(path, mtype="Person") == ["3"]  # same expression, new value
+    assert compile_xpath.cache_info().hits == hits + 2
+
+
+def test_XPATH():
+    m = Module(xml=xml)
+    itemL = XPATH["itemsByType"](m.etree, mtype="Person")
+    assert [itemN.get("id") for itemN in itemL] == ["3"]
+    assert XPATH["itemCountByType"](m.etree, mtype="Object") == 2
+    assert XPATH["mtypes"](m.etree) == ["Object", "Person"]
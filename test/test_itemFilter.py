@@ -0,0 +1,126 @@
+from mpapi.constants import NSMAP
+from mpapi.itemFilter import ItemFilter
+from mpapi.module import Module
+import pytest
+
+xml = """
+<application xmlns="http://www.zetcom.com/ria/ws/module">
+  <modules>
+    <module name="Object" totalSize="2">
+      <moduleItem id="1">
+        <moduleReference name="ObjOwnerRef" targetModule="Address">
+          <moduleReferenceItem moduleItemId="9">
+            <formattedValue language="de">Ethnologisches Museum, Staatliche Museen zu Berlin</formattedValue>
+          </moduleReferenceItem>
+        </moduleReference>
+        <moduleReference name="ObjMultimediaRef" targetModule="Multimedia" size="2">
+          <moduleReferenceItem moduleItemId="10"/>
+          <moduleReferenceItem moduleItemId="11"/>
+        </moduleReference>
+      </moduleItem>
+      <moduleItem id="2">
+        <moduleReference name="ObjOwnerRef" targetModule="Address">
+          <moduleReferenceItem moduleItemId="8">
+            <formattedValue language="de">Museum für Asiatische Kunst</formattedValue>
+          </moduleReferenceItem>
+        </moduleReference>
+      </moduleItem>
+    </module>
+    <module name="Multimedia" totalSize="2">
+      <moduleItem id="10">
+        <dataField name="MulOriginalFileTxt"><value>a.JPG</value></dataField>
+      </moduleItem>
+      <moduleItem id="11">
+        <dataField name="MulOriginalFileTxt"><value>b.pdf</value></dataField>
+      </moduleItem>
+    </module>
+  </modules>
+</application>
+"""
+
+
+def test_default_rules(tmp_path):
+    m = Module(xml=xml)
+    f = ItemFilter.default()
+    assert f.filter(data=m) == 2
+    assert f.removed == {("Object", "2"), ("Multimedia", "11")}
+    assert [itemN.get("id") for itemN in m] == ["1", "10"]
+    refs = m.xpath("//m:moduleReference[@name='ObjMultimediaRef']/*/@moduleItemId")
+    assert refs == ["10"]  # dangling reference dropped
+    assert m.xpath("//m:moduleReference[@name='ObjMultimediaRef']/@size") == ["1"]
+    assert m.totalSize(module="Object") == 1
+    assert 'totalSize="1"' in m.toString()
+    assert not m.item_exists(mtype="Object", ID="2")  # index is up to date
+
+    # streaming gives the same result
+    src = tmp_path / "chunk1.xml"
+    Module(xml=xml).toFile(path=src)
+    target = tmp_path / "filter.zip"
+    assert ItemFilter.default().filterFile(src=src, target=target) == 2
+    IDs = []
+    for itemN in Module.iterfile(target):
+        IDs.append(itemN.get("id"))
+        assert "11" not in itemN.xpath(".//@moduleItemId")
+        if itemN.get("id") == "1":
+            assert itemN.xpath("m:moduleReference[@size]/@size", namespaces=NSMAP) == [
+                "1"
+            ]
+    assert IDs == ["1", "10"]
+
+
+def test_field_rules():
+    f = ItemFilter(
+        rules=[
+            {
+                "mtype": "Object",
+                "field": "ObjOwnerRef",
+                "equals": "Museum für Asiatische Kunst",
+            },
+            {"mtype": "Multimedia", "suffix": ".JPG"},
+        ]
+    )
+    m = Module(xml=xml)
+    assert f.filter(data=m) == 2
+    assert [itemN.get("id") for itemN in m] == ["1", "11"]
+
+    # suffixes are case-sensitive
+    f = ItemFilter(rules=[{"mtype": "Multimedia", "suffix": [".jpg", ".PDF"]}])
+    m = Module(xml=xml)
+    assert f.filter(data=m) == 0
+
+
+def test_not_rules():
+    # two owners, one of them EM: like XPath's != the object is still removed
+    em = "Ethnologisches Museum, Staatliche Museen zu Berlin"
+    other = """
+        <moduleReferenceItem moduleItemId="7">
+          <formattedValue language="de">Kunstbibliothek</formattedValue>
+        </moduleReferenceItem>"""
+    two = xml.replace(
+        '<moduleReferenceItem moduleItemId="9">',
+        other + '\n<moduleReferenceItem moduleItemId="9">',
+    )
+    m = Module(xml=two)
+    assert ItemFilter(rules=[{"mtype": "Object", "notOwner": em}]).filter(data=m) == 2
+    assert [itemN.get("id") for itemN in m] == ["10", "11"]
+
+    # object without owner is kept
+    m = Module(xml=xml.replace("ObjOwnerRef", "ObjOtherRef"))
+    assert ItemFilter(rules=[{"mtype": "Object", "notOwner": em}]).filter(data=m) == 0
+
+    # notEquals works the same way
+    rule = {
+        "mtype": "Object",
+        "field": "ObjOwnerRef",
+        "notEquals": [em, "Kunstbibliothek"],
+    }
+    m = Module(xml=two)
+    assert ItemFilter(rules=[rule]).filter(data=m) == 1
+    assert [itemN.get("id") for itemN in m] == ["1", "10", "11"]
+
+
+def test_bad_rules():
+    with pytest.raises(SyntaxError):
+        ItemFilter(rules=[{"suffix": ".pdf"}])  # no mtype
+    with pytest.raises(SyntaxError):
+        ItemFilter(rules=[{"mtype": "Object", "colour": "red"}])
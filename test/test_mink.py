@@ -0,0 +1,72 @@
+from lxml import etree  # type: ignore
+from mpapi.mink import Mink
+from mpapi.module import Module
+import pytest
+import time
+
+# Mink's constructor runs the job, so we make one without it and replace the
+# chunker with a stub that returns ready-made chunks
+
+
+def chunk(ID: int, *, valid: bool = True) -> Module:
+    bogus = "" if valid else "<bogus/>"
+    return Module(
+        xml=f"""
+        <application xmlns="http://www.zetcom.com/ria/ws/module">
+          <modules>
+            <module name="Object" totalSize="1">
+              <moduleItem id="{ID}">{bogus}</moduleItem>
+            </module>
+          </modules>
+        </application>"""
+    )
+
+
+class StubChunker:
+    chunkSize = 1
+
+    def __init__(self, chunkL: list) -> None:
+        self.chunkL = chunkL
+
+    def getByType(self, **kwargs):
+        yield from self.chunkL
+        yield Module()  # empty chunk at the end
+
+
+class SlowMink(Mink):
+    def _writeChunk(self, *, data, path):
+        # earlier chunks take longer, so they finish last
+        ID = int(data.xpath("//m:moduleItem/@id")[0])
+        time.sleep(0.05 * (5 - ID))
+        super()._writeChunk(data=data, path=path)
+
+
+def mink(tmp_path, chunkL: list, pipeline: int) -> Mink:
+    m = SlowMink.__new__(SlowMink)
+    m.job_data = {"pipeline": pipeline}
+    m.project_dir = tmp_path
+    m.chunker = StubChunker(chunkL)
+    return m
+
+
+@pytest.mark.parametrize("pipeline", [0, 3])
+def test_chunk_order(tmp_path, pipeline):
+    m = mink(tmp_path, [chunk(ID) for ID in range(1, 5)], pipeline)
+    m.chunk(Type="group", ID=7)
+    for no in range(1, 5):
+        zip_fn = tmp_path / f"group7-chunk{no}.zip"
+        IDs = [itemN.get("id") for itemN in Module.iterfile(zip_fn)]
+        assert IDs == [str(no)]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        f"group7-chunk{no}.zip" for no in range(1, 5)
+    ]
+
+
+def test_chunk_invalid(tmp_path):
+    chunkL = [chunk(1), chunk(2, valid=False), chunk(3)]
+    m = mink(tmp_path, chunkL, pipeline=2)
+    with pytest.raises(etree.DocumentInvalid):
+        m.chunk(Type="group", ID=7)
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert "group7-chunk2.zip" not in names
+    assert not [name for name in names if name.startswith(".tmp")]
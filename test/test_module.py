@@ -1,8 +1,10 @@
 from mpapi.constants import NSMAP
-from mpapi.module import Module
+from mpapi.helper import validate_item
+from mpapi.module import CLEAN, UPLOAD_FORM, Module, ModuleWriter
 import lxml
 from lxml import etree  # type: ignore
 import pytest
+from zipfile import ZipFile
 
 # from mpapi.constants import get_credentials
 from mpapi.client import MpApi
@@ -215,3 +217,212 @@ def test_filter():
 def write_to_file(m, fn):
     print(f"Writing to file '{fn}'")
     m.toFile(path=fn)
+
+
+def _item_xml(ID: int, lastModified: str, title: str) -> str:
+    return f"""
+        <moduleItem id="{ID}">
+          <systemField name="__lastModified">
+            <value>{lastModified}</value>
+          </systemField>
+          <dataField dataType="Varchar" name="TitleTxt">
+            <value>{title}</value>
+          </dataField>
+        </moduleItem>"""
+
+
+def _doc_xml(*items: str, mtype: str = "Object") -> str:
+    return f"""
+    <application xmlns="http://www.zetcom.com/ria/ws/module">
+      <modules>
+        <module name="{mtype}">{"".join(items)}
+        </module>
+      </modules>
+    </application>"""
+
+
+def test_add_keeps_newer():
+    m1 = Module(
+        xml=_doc_xml(
+            _item_xml(1, "2021-10-14 07:40:29.0", "old"),
+            _item_xml(2, "2021-10-14 07:40:29.0", "keep"),
+        )
+    )
+    m2 = Module(
+        xml=_doc_xml(
+            _item_xml(1, "2022-01-01 00:00:00.0", "new"),
+            _item_xml(2, "2020-01-01 00:00:00.0", "older"),
+            _item_xml(3, "2020-01-01 00:00:00.0", "added"),
+        )
+    )
+    m3 = m1 + m2
+    assert len(m3) == 3
+    assert m3.totalSize(module="Object") == 3
+    title = "m:dataField[@name = 'TitleTxt']/m:value/text()"
+    assert m3[("Object", 1)].xpath(title, namespaces=NSMAP) == ["new"]
+    assert m3[("Object", 2)].xpath(title, namespaces=NSMAP) == ["keep"]
+    # neither operand is changed
+    assert m1[("Object", 1)].xpath(title, namespaces=NSMAP) == ["old"]
+    assert len(m2) == 3
+
+    m4 = Module(xml=_doc_xml(_item_xml(7, "2020-01-01", "person"), mtype="Person"))
+    m5 = m3 + m4
+    assert m5.describe() == {"Object": 3, "Person": 1}
+    assert len(m4) == 1
+
+
+def test_item_index():
+    m = Module(
+        xml=_doc_xml(
+            _item_xml(1, "2021-01-01", "one"),
+            _item_xml(2, "2021-01-01", "two"),
+        )
+    )
+    assert m.item_exists(mtype="Object", ID=1)
+    assert not m.item_exists(mtype="Object", ID=3)
+    assert not m.item_exists(mtype="Person", ID=1)
+    assert m.get_ids(mtype="Object") == [1, 2]
+
+    # mutating methods keep the index up to date
+    m.delItem(mtype="Object", modItemId=1)
+    assert not m.item_exists(mtype="Object", ID=1)
+    with pytest.raises(IndexError):
+        m[("Object", 1)]
+    newN = Module(xml=_doc_xml(_item_xml(3, "2021-01-01", "three")))[("Object", 3)]
+    m.addItem(itemN=newN, mtype="Person")
+    assert m.item_exists(mtype="Person", ID=3)
+    itemN = m.moduleItem(parent=m.module(name="Person"), ID=3)
+    assert itemN is m[("Person", 3)]
+    assert len(m) == 2
+
+    # items removed by lxml directly are detected
+    itemN = m[("Object", 2)]
+    itemN.getparent().remove(itemN)
+    assert not m.item_exists(mtype="Object", ID=2)
+
+
+def test_iterfile(tmp_path):
+    m = Module(xml=_doc_xml(*[_item_xml(ID, "2021-01-01", "x") for ID in range(5)]))
+    m += Module(xml=_doc_xml(_item_xml(7, "2021-01-01", "p"), mtype="Person"))
+    xml_fn = tmp_path / "chunk1.xml"
+    m.toFile(path=xml_fn)
+    zip_fn = m.toZip(path=xml_fn)
+
+    for fn in [xml_fn, zip_fn]:
+        idL = [itemN.get("id") for itemN in Module.iterfile(fn)]
+        assert idL == ["0", "1", "2", "3", "4", "7"]
+        mtypeL = [itemN.getparent().get("name") for itemN in Module.iterfile(fn)]
+        assert mtypeL == ["Object"] * 5 + ["Person"]
+        idL = [itemN.get("id") for itemN in Module.iterfile(fn, mtype="Person")]
+        assert idL == ["7"]
+
+
+def test_module_writer(tmp_path):
+    m = Module(xml=_doc_xml(*[_item_xml(ID, "2021-01-01", "x") for ID in range(3)]))
+    m += Module(xml=_doc_xml(_item_xml(7, "2021-01-01", "p"), mtype="Person"))
+    for fn in [tmp_path / "pack.xml", tmp_path / "pack.zip"]:
+        with ModuleWriter(path=fn) as w:
+            w.addModule(data=m)
+        assert w.counts == {"Object": 3, "Person": 1}
+        idL = [itemN.get("id") for itemN in Module.iterfile(fn)]
+        assert idL == ["0", "1", "2", "7"]
+    m2 = Module(file=tmp_path / "pack.xml")
+    assert m2.totalSize(module="Object") == 3
+    assert m2.totalSize(module="Person") == 1
+    assert m2.validate()
+    xml = (tmp_path / "pack.xml").read_text()
+    assert '<module name="Object" totalSize="3">' in xml  # no padding
+    assert '<module name="Person" totalSize="1">' in xml
+    assert xml.count("xmlns=") == 1  # declared once on <application>
+    with ZipFile(tmp_path / "pack.zip") as z:
+        assert z.read("pack.xml").decode() == xml
+
+    with ModuleWriter(path=tmp_path / "plain.zip", totalSize=False) as w:
+        w.addModule(data=m)
+    with ZipFile(tmp_path / "plain.zip") as z:
+        assert "totalSize" not in z.read("plain.xml").decode()
+
+    with pytest.raises(ValueError):
+        with ModuleWriter(path=tmp_path / "broken.xml") as w:
+            w.add(itemN=m[("Object", 1)])
+            w.add(itemN=m[("Person", 7)])
+            w.add(itemN=m[("Object", 2)])
+    assert not (tmp_path / "broken.xml").exists()
+
+
+def test_validate_item(tmp_path):
+    m = Module(xml=_doc_xml(_item_xml(1, "2021-01-01", "x")))
+    itemN = m[("Object", 1)]
+    assert validate_item(itemN)
+    etree.SubElement(itemN, "{%s}bogus" % NSMAP["m"])
+    with pytest.raises(etree.DocumentInvalid):
+        validate_item(itemN, mtype="Object")
+    with pytest.raises(etree.DocumentInvalid):
+        with ModuleWriter(path=tmp_path / "invalid.xml", validate=True) as w:
+            w.addModule(data=m)
+    assert not (tmp_path / "invalid.xml").exists()
+
+
+def test_from_bytes():
+    xml = _doc_xml(_item_xml(1, "2021-01-01", "Ä"))
+    m = Module(xml=xml.encode("utf-8"))
+    assert m.toString() == Module(xml=xml).toString()
+    with pytest.raises(SyntaxError):
+        Module(xml=b"<application>")
+
+
+def test_transform_single_item():
+    xml = """
+    <application xmlns="http://www.zetcom.com/ria/ws/module">
+      <modules>
+        <module name="Object" totalSize="1">
+          <moduleItem id="1" uuid="abc" hasAttachments="false">
+            <systemField name="__id"><value>1</value></systemField>
+            <systemField name="__orgUnit"><value>EMMusikethnologie</value></systemField>
+            <virtualField name="ObjObjectVrt"><value>x</value></virtualField>
+            <dataField dataType="Clob" name="ObjTechnicalTermClb" uuid="d">
+              <value>Trommel</value>
+              <formattedValue language="de">Trommel</formattedValue>
+            </dataField>
+            <repeatableGroup name="ObjValuationGrp" size="1"/>
+          </moduleItem>
+        </module>
+      </modules>
+    </application>"""
+    m = Module(xml=xml)
+    itemN = m[("Object", "1")]
+    (CLEAN + UPLOAD_FORM).apply(itemN)
+    assert m.xpath("//@uuid | //@hasAttachments | //@dataType") == []
+    assert m.xpath("count(//m:virtualField | //m:formattedValue)") == 0
+    assert m.xpath("//m:systemField/@name") == ["__orgUnit"]
+    assert m.xpath("count(//m:repeatableGroup)") == 0
+    assert m.xpath("//m:module/@totalSize") == ["1"]  # outside of itemN
+
+    m2 = Module(xml=xml)
+    m2.clean()
+    m2.uploadForm()
+    assert etree.tostring(m2[("Object", "1")]) == etree.tostring(itemN)
+
+
+def test_lazy_totalSize(tmp_path):
+    m = Module()
+    itemN = etree.fromstring(
+        '<moduleItem xmlns="http://www.zetcom.com/ria/ws/module" id="1"/>'
+    )
+    for ID in range(3):
+        itemN.set("id", str(ID))
+        m.addItem(itemN=itemN, mtype="Object")
+    assert m._dirty
+    assert m.totalSize(module="Object") == 3
+    assert not m._dirty
+    m.addItem(itemN=itemN, mtype="Person")
+    m.toFile(path=tmp_path / "out.xml")
+    m2 = Module(file=tmp_path / "out.xml")
+    assert m2.totalSize(module="Person") == 1
+
+    # upload form has no totalSize, even if items have been added before
+    m.addItem(itemN=itemN, mtype="Person")
+    m.uploadForm()
+    assert "totalSize" not in m.toString()
+    m.toFile(path=tmp_path / "upload.xml")
+    assert "totalSize" not in (tmp_path / "upload.xml").read_text()
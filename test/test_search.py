@@ -2,6 +2,7 @@
 Test the Search module
 """
 
+from mpapi.constants import XPATH
 from mpapi.search import Search
 import pytest
 
@@ -232,3 +233,24 @@ def test_exists():
     q.toFile(path="debug.exists.xml")
 
     assert q.validate(mode="search") is True
+
+
+def test_addField_nested():
+    s = Search(module="Object")
+    s.addCriterion(operator="equalsField", field="__id", value="1234")
+    s.addField(field="ObjMultimediaRef.moduleReferenceItem.dataField.ThumbnailBoo")
+    s.addField(field="ObjMultimediaRef.ThumbnailBoo")  # same field
+    s.addField(field="__id")
+    fields = s.etree.xpath(
+        "//s:select/s:field/@fieldPath",
+        namespaces={"s": "http://www.zetcom.com/ria/ws/module/search"},
+    )
+    assert fields == ["ObjMultimediaRef.ThumbnailBoo", "__id"]
+    assert s.validate(mode="search") is True
+
+
+def test_addField_without_expert():
+    s = Search(module="Object")
+    XPATH["expert"](s.etree)[0].getparent().remove(XPATH["expert"](s.etree)[0])
+    s.addField(field="__id")
+    assert len(XPATH["select"](s.etree)) == 1